@@ -1,36 +1,376 @@
-import json
-from typing import Any, Optional
+import asyncio
+import logging
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
+import orjson
 import redis
+import redis.asyncio as aioredis
 
 from .config import settings
 
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "cache:generation"
+INVALIDATE_CHANNEL = "cache:invalidate"
+
+# Redis values are one codec byte, the time (epoch seconds) the entry stays
+# fresh until, then the payload. Entries are kept in Redis for
+# ``cache_stale_seconds`` past that time so they can be served stale while
+# one worker refreshes them.
+_CODEC_PLAIN = b"\x00"
+_CODEC_ZLIB = b"\x01"
+_FRESH_UNTIL = struct.Struct(">d")
+_HEADER_SIZE = 1 + _FRESH_UNTIL.size
+
+# Delete a fill lock only if this worker still holds it.
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+Filler = Callable[[List[str]], Awaitable[Dict[str, bytes]]]
+
+
+def _pack(payload: bytes, fresh_until: float) -> bytes:
+    """Encode JSON bytes for Redis, zlib-compressing large payloads."""
+    threshold = settings.cache_compress_min_bytes
+    if threshold > 0 and len(payload) >= threshold:
+        return _CODEC_ZLIB + _FRESH_UNTIL.pack(fresh_until) + zlib.compress(payload, 1)
+    return _CODEC_PLAIN + _FRESH_UNTIL.pack(fresh_until) + payload
+
+
+def _unpack(data: bytes) -> Tuple[bytes, float]:
+    (fresh_until,) = _FRESH_UNTIL.unpack_from(data, 1)
+    payload = data[_HEADER_SIZE:]
+    if data[:1] == _CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    return payload, fresh_until
+
+
+class LocalCache:
+    """Bounded in-process LRU whose entries also expire after a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + min(ttl_seconds, self.ttl_seconds)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
 
 class Cache:
+    """Two-tier cache: a per-process LocalCache in front of Redis.
+
+    Keys are namespaced by a generation counter stored in Redis. ``invalidate``
+    bumps the counter, which orphans every existing entry in O(1) (old keys
+    age out through their TTL), and publishes the new generation so other
+    workers drop their local tier. Workers also re-read the counter every
+    ``cache_generation_check_seconds`` in case a message was missed.
+
+    Values are stored as orjson-encoded bytes so a hit can be sent as the
+    response body without being decoded and re-encoded.
+
+    ``aget_or_fill_raw``/``aget_or_fill_many_raw`` coalesce misses: one fill
+    per key set runs in a process at a time, and a short Redis lock elects a
+    single filler across workers.
+    """
+
     def __init__(self) -> None:
         self.enabled = settings.redis_enabled
         self.client: Optional[redis.Redis] = None
+        self.async_client: Optional[aioredis.Redis] = None
+        self.local = LocalCache(settings.local_cache_max_entries, settings.local_cache_ttl_seconds)
+        self.generation = 0
+        self._checked_at = time.monotonic()
+        self._pubsub = None
+        self._listener = None
+        # (flight key, waits for other workers) -> fill in progress
+        self._inflight: Dict[Tuple[str, bool], "asyncio.Future[Dict[str, bytes]]"] = {}
+        self._background: Set["asyncio.Future[Dict[str, bytes]]"] = set()
         if self.enabled:
             try:
-                self.client = redis.from_url(settings.redis_url, decode_responses=True)
+                self.client = redis.from_url(settings.redis_url)
                 self.client.ping()
+                self.async_client = aioredis.from_url(settings.redis_url)
+                self.generation = int(self.client.get(GENERATION_KEY) or 0)
             except Exception:
                 self.client = None
+                self.async_client = None
                 self.enabled = False
 
-    def get_json(self, key: str) -> Optional[Any]:
-        if not (self.enabled and self.client):
-            return None
-        data = self.client.get(key)
+    def _key(self, key: str, generation: Optional[int] = None) -> str:
+        return f"g{self.generation if generation is None else generation}:{key}"
+
+    def _set_generation(self, generation: int) -> None:
+        if generation != self.generation:
+            self.generation = generation
+            self.local.clear()
+
+    def _generation_check_due(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < settings.cache_generation_check_seconds:
+            return False
+        self._checked_at = now
+        return True
+
+    def _check_generation(self) -> None:
+        if self.enabled and self.client and self._generation_check_due():
+            self._set_generation(int(self.client.get(GENERATION_KEY) or 0))
+
+    async def _acheck_generation(self) -> None:
+        if self.enabled and self.async_client and self._generation_check_due():
+            self._set_generation(int(await self.async_client.get(GENERATION_KEY) or 0))
+
+    def _from_redis(self, full_key: str, data: Optional[bytes]) -> Tuple[Optional[bytes], bool]:
+        """Decode a Redis value into ``(payload, stale)``, keeping fresh ones locally."""
         if data is None:
-            return None
-        return json.loads(data)
+            return None, False
+        payload, fresh_until = _unpack(data)
+        remaining = fresh_until - time.time()
+        if remaining > 0:
+            self.local.set(full_key, payload, remaining)
+        return payload, remaining <= 0
 
-    def set_json(self, key: str, value: Any, ttl_seconds: int = 3600) -> None:
+    def _redis_ttl(self, ttl_seconds: int) -> int:
+        return ttl_seconds + settings.cache_stale_seconds
+
+    def get_raw(self, key: str) -> Optional[bytes]:
+        """Return the cached JSON bytes for ``key``, ready to send as a response body."""
+        self._check_generation()
+        full_key = self._key(key)
+        payload = self.local.get(full_key)
+        if payload is not None or not (self.enabled and self.client):
+            return payload
+        payload, stale = self._from_redis(full_key, self.client.get(full_key))
+        return None if stale else payload
+
+    def set_raw(self, key: str, payload: bytes, ttl_seconds: int = 3600) -> None:
+        full_key = self._key(key)
+        self.local.set(full_key, payload, ttl_seconds)
         if not (self.enabled and self.client):
             return
-        self.client.setex(key, ttl_seconds, json.dumps(value))
+        self.client.setex(full_key, self._redis_ttl(ttl_seconds), _pack(payload, time.time() + ttl_seconds))
 
+    def get_json(self, key: str) -> Optional[Any]:
+        payload = self.get_raw(key)
+        return None if payload is None else orjson.loads(payload)
 
-cache = Cache()
+    def set_json(self, key: str, value: Any, ttl_seconds: int = 3600) -> None:
+        self.set_raw(key, orjson.dumps(value), ttl_seconds)
+
+    async def _aread_many(self, full_keys: List[str]) -> Tuple[List[Optional[bytes]], List[bool]]:
+        """Look up several keys; local misses are fetched from Redis with one MGET."""
+        payloads = [self.local.get(full_key) for full_key in full_keys]
+        stale = [False] * len(full_keys)
+        missing = [i for i, payload in enumerate(payloads) if payload is None]
+        if missing and self.enabled and self.async_client:
+            found = await self.async_client.mget([full_keys[i] for i in missing])
+            for i, data in zip(missing, found):
+                payloads[i], stale[i] = self._from_redis(full_keys[i], data)
+        return payloads, stale
+
+    async def aget_raw(self, key: str) -> Optional[bytes]:
+        await self._acheck_generation()
+        (payload,), (stale,) = await self._aread_many([self._key(key)])
+        return None if stale else payload
+
+    async def aset_raw(self, key: str, payload: bytes, ttl_seconds: int = 3600) -> None:
+        await self.aset_many_raw({key: payload}, ttl_seconds)
+
+    async def aget_json(self, key: str) -> Optional[Any]:
+        payload = await self.aget_raw(key)
+        return None if payload is None else orjson.loads(payload)
+
+    async def aset_json(self, key: str, value: Any, ttl_seconds: int = 3600) -> None:
+        await self.aset_raw(key, orjson.dumps(value), ttl_seconds)
+
+    async def aset_many_raw(self, payloads: Dict[str, bytes], ttl_seconds: int = 3600,
+                            generation: Optional[int] = None) -> None:
+        """Store several keys in one pipelined round trip.
+
+        ``generation`` files them under that generation instead of the current
+        one, so a fill that began before an ``invalidate`` cannot land its
+        now-stale payloads in the new generation.
+        """
+        full_payloads = {self._key(key, generation): payload for key, payload in payloads.items()}
+        for full_key, payload in full_payloads.items():
+            self.local.set(full_key, payload, ttl_seconds)
+        if not full_payloads or not (self.enabled and self.async_client):
+            return
+        fresh_until = time.time() + ttl_seconds
+        async with self.async_client.pipeline(transaction=False) as pipe:
+            for full_key, payload in full_payloads.items():
+                pipe.setex(full_key, self._redis_ttl(ttl_seconds), _pack(payload, fresh_until))
+            await pipe.execute()
+
+    async def aget_or_fill_raw(self, key: str, fill: Callable[[], Awaitable[bytes]],
+                               ttl_seconds: int = 3600) -> bytes:
+        """Return the cached bytes for ``key``, computing them with ``fill`` on a miss."""
+        async def fill_one(_keys: List[str]) -> Dict[str, bytes]:
+            return {key: await fill()}
+
+        (payload,) = await self.aget_or_fill_many_raw([key], fill_one, ttl_seconds)
+        return payload
+
+    async def aget_or_fill_many_raw(self, keys: List[str], fill: Filler,
+                                    ttl_seconds: int = 3600) -> List[bytes]:
+        """Return the cached bytes for ``keys``, computing the missing ones with ``fill``.
+
+        ``fill`` receives the missing keys and returns a payload for each.
+        Entries past their TTL but still within ``cache_stale_seconds`` are
+        returned as they are and refreshed in the background.
+        """
+        await self._acheck_generation()
+        # everything below is read and written under the generation seen now
+        generation = self.generation
+        payloads, stale = await self._aread_many([self._key(key, generation) for key in keys])
+        stale_keys = [key for key, is_stale in zip(keys, stale) if is_stale]
+        if stale_keys:
+            self._refresh_in_background(stale_keys, fill, ttl_seconds, generation)
+        missing = [key for key, payload in zip(keys, payloads) if payload is None]
+        if missing:
+            filled = await self._fill_once(missing, fill, ttl_seconds, generation, wait=True)
+            payloads = [filled[key] if payload is None else payload for key, payload in zip(keys, payloads)]
+        return payloads
+
+    async def _fill_once(self, keys: List[str], fill: Filler, ttl_seconds: int,
+                         generation: int, wait: bool) -> Dict[str, bytes]:
+        """Run ``fill`` for ``keys`` unless this process already has the same fill in flight.
+
+        Waiting fills and background refreshes are separate flights: a
+        refresh gives up when another worker holds the lock, so a miss must
+        not join it and be left without a payload.
+        """
+        flight = self._key(",".join(keys), generation)
+        task = self._inflight.get((flight, wait))
+        if task is None:
+            task = asyncio.ensure_future(
+                self._fill_across_workers(flight, keys, fill, ttl_seconds, generation, wait)
+            )
+            self._inflight[(flight, wait)] = task
+            task.add_done_callback(lambda _: self._inflight.pop((flight, wait), None))
+        # shielded so a disconnecting client does not cancel the fill for the others
+        return await asyncio.shield(task)
+
+    async def _fill_across_workers(self, flight: str, keys: List[str], fill: Filler,
+                                   ttl_seconds: int, generation: int, wait: bool) -> Dict[str, bytes]:
+        if not (self.enabled and self.async_client):
+            return await self._fill_and_store(keys, fill, ttl_seconds, generation)
 
+        lock_key = f"lock:{flight}"
+        token = uuid.uuid4().hex
+        lock_ms = int(settings.cache_fill_lock_seconds * 1000)
+        if await self.async_client.set(lock_key, token, nx=True, px=lock_ms):
+            try:
+                return await self._fill_and_store(keys, fill, ttl_seconds, generation)
+            finally:
+                await self.async_client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+        if not wait:
+            return {}
+
+        # Another worker holds the lock: wait for its result, and fill
+        # ourselves only if it gives up (lock released or expired) without one.
+        full_keys = [self._key(key, generation) for key in keys]
+        deadline = time.monotonic() + settings.cache_fill_lock_seconds
+        while True:
+            await asyncio.sleep(settings.cache_fill_poll_seconds)
+            payloads, stale = await self._aread_many(full_keys)
+            if all(payload is not None for payload in payloads) and not any(stale):
+                return dict(zip(keys, payloads))
+            if time.monotonic() >= deadline or not await self.async_client.exists(lock_key):
+                break
+        payloads, stale = await self._aread_many(full_keys)
+        if all(payload is not None for payload in payloads) and not any(stale):
+            return dict(zip(keys, payloads))
+        return await self._fill_and_store(keys, fill, ttl_seconds, generation)
+
+    async def _fill_and_store(self, keys: List[str], fill: Filler, ttl_seconds: int,
+                              generation: int) -> Dict[str, bytes]:
+        filled = await fill(keys)
+        await self.aset_many_raw(filled, ttl_seconds, generation)
+        return filled
+
+    def _refresh_in_background(self, keys: List[str], fill: Filler, ttl_seconds: int,
+                               generation: int) -> None:
+        flight = self._key(",".join(keys), generation)
+        if (flight, False) in self._inflight or (flight, True) in self._inflight:
+            return
+        task = asyncio.ensure_future(self._fill_once(keys, fill, ttl_seconds, generation, wait=False))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: "asyncio.Future[Dict[str, bytes]]") -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.exception("Background cache refresh failed", exc_info=task.exception())
+
+    def invalidate(self) -> int:
+        """Start a new cache generation everywhere; returns the new generation."""
+        if self.enabled and self.client:
+            generation = int(self.client.incr(GENERATION_KEY))
+            self.client.publish(INVALIDATE_CHANNEL, generation)
+        else:
+            generation = self.generation + 1
+        self._set_generation(generation)
+        return generation
+
+    def _on_invalidate(self, message: dict) -> None:
+        self._set_generation(int(message["data"]))
+
+    def start_listener(self) -> None:
+        """Follow other workers' invalidations over Redis pub/sub in a daemon thread."""
+        if not (self.enabled and self.client) or self._listener is not None:
+            return
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{INVALIDATE_CHANNEL: self._on_invalidate})
+        self._listener = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def stop_listener(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener.join(timeout=2.0)
+            self._listener = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+    async def aclose(self) -> None:
+        self.stop_listener()
+        if self.async_client is not None:
+            await self.async_client.aclose()
+
+
+cache = Cache()
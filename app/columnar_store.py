@@ -0,0 +1,157 @@
+"""Date x symbol matrices of market caps and adjusted closes, stored as ``.npy`` files.
+
+``ingest.py`` writes a store after every load and the vectorized build engine
+memory-maps it instead of pivoting rows read from SQLite. A store is written
+into a directory named after the ``market_data`` version in ``data_versions``,
+which ingest bumps before it touches ``daily_prices``/``daily_market_caps``;
+a store whose version is not the current one is never opened, so builds fall
+back to SQL until the matching store has been written. After a delta ingest
+the new version is the previous one with only the trailing dates re-read.
+"""
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+from .config import settings
+from .db import data_version
+
+DATA_VERSION_NAME = "market_data"
+
+
+class ColumnarStore(NamedTuple):
+    """Memory-mapped market data; row i of each matrix is ``dates[i]``, column j ``symbol_ids[j]``."""
+
+    dates: np.ndarray       # ISO date strings, ascending
+    symbol_ids: np.ndarray  # ascending
+    market_cap: np.ndarray  # float64, NaN where a symbol has no market cap that day
+    adj_close: np.ndarray   # float64, aligned to market_cap
+
+
+def store_root() -> Path:
+    return Path(settings.columnar_store_dir or f"{settings.database_path}-columns")
+
+
+def open_store(conn: sqlite3.Connection) -> Optional[ColumnarStore]:
+    """Map the store matching the database's current market data, or None if there is none."""
+    if not settings.columnar_store_enabled:
+        return None
+    try:
+        version = data_version(conn, DATA_VERSION_NAME)
+    except sqlite3.OperationalError:
+        return None  # data_versions not created yet: init_db has not run on this file
+    return _map_store(store_root() / f"v{version}")
+
+
+def _map_store(path: Path) -> Optional[ColumnarStore]:
+    if not path.is_dir():
+        return None
+    return ColumnarStore(
+        dates=np.load(path / "dates.npy"),
+        symbol_ids=np.load(path / "symbol_ids.npy"),
+        market_cap=np.load(path / "market_cap.npy", mmap_mode="r"),
+        adj_close=np.load(path / "adj_close.npy", mmap_mode="r"),
+    )
+
+
+def write_store(conn: sqlite3.Connection, since: Optional[str] = None) -> Optional[Path]:
+    """Write the store for the current market data version unless it already exists.
+
+    ``since`` is the earliest date the load that bumped the version wrote.
+    When it is given, the previous version's store exists and no symbol
+    outside it has rows from ``since`` on, the dates before ``since`` are
+    copied from that store and only the rest is read from SQLite, so a
+    daily delta ingest costs one file copy instead of a scan of the whole
+    history. Otherwise every row is read.
+
+    Everything is read inside one transaction, so the matrices match the
+    version they are filed under. Rows are streamed into memory-mapped output
+    files a chunk at a time, and the finished directory is renamed into place
+    so readers never see a partial store. Older versions are removed; builds
+    still mapping them keep their open files.
+    """
+    if not settings.columnar_store_enabled:
+        return None
+    root = store_root()
+    conn.execute("BEGIN")
+    try:
+        version = data_version(conn, DATA_VERSION_NAME)
+        target = root / f"v{version}"
+        if target.is_dir():
+            return target
+        # only the store of the version right before was made from the rows before ``since``
+        base = _map_store(root / f"v{version - 1}") if since is not None else None
+        if base is not None:
+            since_symbols = [s for (s,) in conn.execute(
+                "SELECT DISTINCT symbol_id FROM daily_market_caps WHERE date >= ?", (since,)
+            )]
+            if not np.isin(since_symbols, base.symbol_ids).all():
+                base = None  # new symbols: their whole history has to be laid out
+        if base is not None:
+            kept = int(np.searchsorted(base.dates, since, side="left"))
+            date_filter, params = "WHERE m.date >= ?", (since,)
+            symbol_ids = base.symbol_ids
+        else:
+            kept = 0
+            date_filter, params = "", ()
+            symbol_ids = np.array(
+                [s for (s,) in conn.execute("SELECT DISTINCT symbol_id FROM daily_market_caps ORDER BY 1")],
+                dtype=np.int64,
+            )
+        # CAST keeps the DATE converter from turning every value into a datetime.date
+        new_dates = [d for (d,) in conn.execute(
+            f"SELECT DISTINCT CAST(date AS TEXT) FROM daily_market_caps m {date_filter} ORDER BY 1", params
+        )]
+        kept_dates = base.dates[:kept].tolist() if base is not None else []
+        dates = np.array(kept_dates + new_dates, dtype="U10")
+
+        tmp = root / f".tmp-v{version}-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / "dates.npy", dates)
+        np.save(tmp / "symbol_ids.npy", symbol_ids)
+        shape = (len(dates), len(symbol_ids))
+        matrices = {
+            field: np.lib.format.open_memmap(tmp / f"{field}.npy", mode="w+", dtype=np.float64, shape=shape)
+            for field in ("market_cap", "adj_close")
+        }
+        for field, matrix in matrices.items():
+            if kept:
+                matrix[:kept] = getattr(base, field)[:kept]
+            matrix[kept:] = np.nan
+
+        chunks = pd.read_sql_query(
+            f"""
+            SELECT CAST(m.date AS TEXT) AS date, m.symbol_id, m.market_cap, p.adj_close
+            FROM daily_market_caps m
+            LEFT JOIN daily_prices p ON p.symbol_id = m.symbol_id AND p.date = m.date
+            {date_filter}
+            """,
+            conn,
+            params=params,
+            chunksize=settings.bulk_chunk_rows,
+        )
+        for chunk in chunks:
+            rows = np.searchsorted(dates, chunk["date"].to_numpy(dtype="U10"))
+            cols = np.searchsorted(symbol_ids, chunk["symbol_id"].to_numpy(dtype=np.int64))
+            for field, matrix in matrices.items():
+                matrix[rows, cols] = chunk[field].to_numpy(dtype=np.float64, na_value=np.nan)
+        for matrix in matrices.values():
+            matrix.flush()
+        del matrices, base
+    finally:
+        conn.rollback()
+
+    try:
+        os.replace(tmp, target)
+    except OSError:
+        # another process filed the same version first
+        shutil.rmtree(tmp, ignore_errors=True)
+    for old in root.iterdir():
+        if old.is_dir() and old.name.startswith("v") and old != target:
+            shutil.rmtree(old, ignore_errors=True)
+    return target
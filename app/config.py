@@ -9,7 +9,30 @@ class Settings(BaseModel):
     database_path: str = os.getenv("DATABASE_PATH", "/data/index.db")
     redis_url: str = os.getenv("REDIS_URL", "redis://redis:6379/0")
     redis_enabled: bool = os.getenv("REDIS_ENABLED", "true").lower() == "true"
+    local_cache_max_entries: int = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "1024"))
+    local_cache_ttl_seconds: float = float(os.getenv("LOCAL_CACHE_TTL_SECONDS", "60"))
+    cache_generation_check_seconds: float = float(os.getenv("CACHE_GENERATION_CHECK_SECONDS", "5"))
+    cache_compress_min_bytes: int = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "16384"))  # 0 = never
+    cache_stale_seconds: int = int(os.getenv("CACHE_STALE_SECONDS", "300"))
+    cache_fill_lock_seconds: float = float(os.getenv("CACHE_FILL_LOCK_SECONDS", "10"))
+    cache_fill_poll_seconds: float = float(os.getenv("CACHE_FILL_POLL_SECONDS", "0.05"))
     index_base_level: float = float(os.getenv("INDEX_BASE_LEVEL", "100.0"))
+    index_engine: str = os.getenv("INDEX_ENGINE", "vectorized")
+    build_workers: int = int(os.getenv("BUILD_WORKERS", "0"))  # parallel engine; 0 = one per CPU
+    build_job_history: int = int(os.getenv("BUILD_JOB_HISTORY", "100"))  # finished jobs kept for /build-jobs
+    index_definitions: str = os.getenv("INDEX_DEFINITIONS", "")  # JSON list; empty = equal-weighted top 100
+    analytics_window_days: int = int(os.getenv("ANALYTICS_WINDOW_DAYS", "21"))
+    composition_changes_method: str = os.getenv("COMPOSITION_CHANGES_METHOD", "table")
+    sqlite_mmap_size: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    sqlite_cache_size: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative = KiB
+    sqlite_temp_store: str = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+    sqlite_cached_statements: int = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+    # none keeps DATE columns as the ISO strings they are stored as; decltypes/colnames as in sqlite3
+    sqlite_detect_types: str = os.getenv("SQLITE_DETECT_TYPES", "none")
+    db_executor_workers: int = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+    bulk_chunk_rows: int = int(os.getenv("BULK_CHUNK_ROWS", "100000"))
+    columnar_store_enabled: bool = os.getenv("COLUMNAR_STORE_ENABLED", "true").lower() == "true"
+    columnar_store_dir: str = os.getenv("COLUMNAR_STORE_DIR", "")  # empty = "<database_path>-columns"
 
 
 settings = Settings()
@@ -1,29 +1,252 @@
+import asyncio
+import functools
+import itertools
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
 import datetime as dt
 
 DB_DIR = Path("/codemill/jainpran/dig_2025_test/data")
 DB_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def get_connection(db_path: Optional[str] = None) -> sqlite3.Connection:
+_DETECT_TYPES = {
+    "none": 0,
+    "decltypes": sqlite3.PARSE_DECLTYPES,
+    "colnames": sqlite3.PARSE_COLNAMES,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def detect_types_flags(setting: str) -> int:
+    """sqlite3 ``detect_types`` flags for a comma-separated ``SQLITE_DETECT_TYPES`` value."""
+    flags = 0
+    for name in setting.split(","):
+        name = name.strip().lower()
+        if name not in _DETECT_TYPES:
+            raise ValueError(f"Unsupported SQLITE_DETECT_TYPES value: {name}")
+        flags |= _DETECT_TYPES[name]
+    return flags
+
+
+def get_connection(db_path: Optional[str] = None,
+                   check_same_thread: bool = True,
+                   read_only: bool = False) -> sqlite3.Connection:
     from .config import settings
 
     path = db_path or settings.database_path
-    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn = sqlite3.connect(
+        path,
+        detect_types=detect_types_flags(settings.sqlite_detect_types),
+        check_same_thread=check_same_thread,
+        cached_statements=settings.sqlite_cached_statements,
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL;")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON;")
+    else:
+        conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA foreign_keys=ON;")
+    conn.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)};")
+    conn.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)};")
+    conn.execute(f"PRAGMA temp_store={settings.sqlite_temp_store};")
     return conn
 
-def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
-    """Convert sqlite3.Row to dict, with date/datetime objects converted to ISO strings."""
-    d = dict(row)
-    for k, v in d.items():
-        if isinstance(v, (dt.date, dt.datetime)):
-            d[k] = v.isoformat()
-    return d
+
+class ConnectionPool:
+    """Long-lived connections shared across requests.
+
+    Each thread gets its own read-only connection, opened on first use and
+    reused afterwards. Writes go through a single connection guarded by a
+    lock, so concurrent writers are serialized instead of racing for the
+    SQLite write lock. Connections are reopened if ``settings.database_path``
+    changes.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writer_lock = threading.RLock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_path: Optional[str] = None
+        self._readers: List[sqlite3.Connection] = []
+
+    @staticmethod
+    def _path() -> str:
+        from .config import settings
+
+        return settings.database_path
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        path = self._path()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.path != path:
+            # check_same_thread=False only so close() can run from any thread
+            conn = get_connection(path, check_same_thread=False, read_only=True)
+            self._local.conn, self._local.path = conn, path
+            with self._lock:
+                self._readers.append(conn)
+        yield conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        with self._writer_lock:
+            path = self._path()
+            if self._writer is None or self._writer_path != path:
+                if self._writer is not None:
+                    self._writer.close()
+                self._writer = get_connection(path, check_same_thread=False)
+                self._writer_path = path
+            yield self._writer
+
+    def close(self) -> None:
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self._local = threading.local()
+
+
+pool = ConnectionPool()
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _db_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from .config import settings
+
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.db_executor_workers, thread_name_prefix="db"
+            )
+        return _executor
+
+
+async def run_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking database work on the bounded DB executor from async code.
+
+    The executor's threads each keep one pooled reader connection, so the
+    number of open SQLite connections stays at ``db_executor_workers``.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_db_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+def _iso(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, dt.date) else value
+
+_LEGACY_SYMBOL_TABLES = ("stocks", "daily_prices", "daily_market_caps", "index_compositions")
+
+
+def _migrate_symbol_ids(conn: sqlite3.Connection, schema_sql: str) -> None:
+    """Move a database keyed on ``symbol TEXT`` to integer ``symbol_id`` keys.
+
+    Legacy tables are renamed, recreated from the current schema and refilled
+    with tickers swapped for their ids. No-op for new or already migrated files.
+    """
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(stocks)")}
+    if not cols or "symbol_id" in cols:
+        return
+    renames = "".join(
+        f"ALTER TABLE {t} RENAME TO {t}_legacy;\n" for t in _LEGACY_SYMBOL_TABLES
+    )
+    conn.executescript(f"""
+        PRAGMA foreign_keys=OFF;
+        BEGIN;
+        DROP INDEX IF EXISTS idx_prices_date;
+        DROP INDEX IF EXISTS idx_mcaps_date;
+        DROP INDEX IF EXISTS idx_compo_date;
+        {renames}
+        {schema_sql.replace("PRAGMA foreign_keys = ON;", "")}
+        INSERT INTO stocks(symbol, name, sector, industry, exchange)
+            SELECT symbol, name, sector, industry, exchange FROM stocks_legacy ORDER BY symbol;
+        INSERT INTO daily_prices(symbol_id, date, close, adj_close, volume)
+            SELECT s.symbol_id, p.date, p.close, p.adj_close, p.volume
+            FROM daily_prices_legacy p JOIN stocks s ON s.symbol = p.symbol;
+        INSERT INTO daily_market_caps(symbol_id, date, market_cap)
+            SELECT s.symbol_id, m.date, m.market_cap
+            FROM daily_market_caps_legacy m JOIN stocks s ON s.symbol = m.symbol;
+        INSERT INTO index_compositions(date, symbol_id, weight)
+            SELECT c.date, s.symbol_id, c.weight
+            FROM index_compositions_legacy c JOIN stocks s ON s.symbol = c.symbol;
+        DROP TABLE index_compositions_legacy;
+        DROP TABLE daily_market_caps_legacy;
+        DROP TABLE daily_prices_legacy;
+        DROP TABLE stocks_legacy;
+        COMMIT;
+        PRAGMA foreign_keys=ON;
+    """)
+
+
+_INDEX_TABLES = ("index_compositions", "index_composition_changes", "index_performance", "index_analytics")
+
+
+def _migrate_index_ids(conn: sqlite3.Connection, schema_sql: str) -> None:
+    """Key the index tables on ``index_id``, filing existing rows under the default index.
+
+    The tables are renamed, recreated from the current schema and refilled,
+    with ``index_id`` taken from its column default. No-op for new or
+    already migrated files.
+    """
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(index_performance)")}
+    if not cols or "index_id" in cols:
+        return
+    tables = [
+        t for t in _INDEX_TABLES
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (t,)).fetchone()
+    ]
+    copies = ""
+    for t in tables:
+        col_list = ", ".join(r[1] for r in conn.execute(f"PRAGMA table_info({t})"))
+        copies += f"INSERT INTO {t}({col_list}) SELECT {col_list} FROM {t}_legacy;\n"
+    renames = "".join(f"ALTER TABLE {t} RENAME TO {t}_legacy;\n" for t in tables)
+    drops = "".join(f"DROP TABLE {t}_legacy;\n" for t in tables)
+    conn.executescript(f"""
+        PRAGMA foreign_keys=OFF;
+        BEGIN;
+        {renames}
+        {schema_sql.replace("PRAGMA foreign_keys = ON;", "")}
+        {copies}
+        {drops}
+        COMMIT;
+        PRAGMA foreign_keys=ON;
+    """)
+
+
+# columns added after a table was first created: table -> [(column, type)]
+_ADDED_COLUMNS = {
+    "stocks": [("shares_outstanding", "INTEGER")],
+}
+
+
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    """Add columns that ``CREATE TABLE IF NOT EXISTS`` cannot add to existing tables."""
+    for table, columns in _ADDED_COLUMNS.items():
+        existing = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+        for column, col_type in columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
 
 def init_db(conn: Optional[sqlite3.Connection] = None) -> None:
     close_conn = False
@@ -32,7 +255,11 @@ def init_db(conn: Optional[sqlite3.Connection] = None) -> None:
         close_conn = True
     schema_path = Path(__file__).with_name("schema.sql")
     with open(schema_path, "r", encoding="utf-8") as f:
-        conn.executescript(f.read())
+        schema_sql = f.read()
+    _migrate_symbol_ids(conn, schema_sql)
+    _migrate_index_ids(conn, schema_sql)
+    conn.executescript(schema_sql)
+    _add_missing_columns(conn)
     if close_conn:
         conn.close()
 
@@ -46,9 +273,179 @@ def execute(conn: sqlite3.Connection, sql: str, params: Tuple[Any, ...] = ()) ->
     with conn:
         conn.execute(sql, params)
 
+QUERY_MODES = ("dict", "tuple", "columns")
+
+
+def _tuple_cursor(conn: sqlite3.Connection, sql: str,
+                  params: Tuple[Any, ...]) -> Tuple[sqlite3.Cursor, List[str]]:
+    """Execute on a cursor that returns plain tuples, whatever the connection's row_factory."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(sql, params)
+    return cur, [d[0] for d in cur.description or ()]
+
+
+def iter_query(
+    conn: sqlite3.Connection, sql: str, params: Tuple[Any, ...] = (), mode: str = "dict"
+) -> Iterator[Any]:
+    """Yield the rows of a query as the cursor steps through them.
+
+    ``mode="tuple"`` yields the cursor's own tuples; ``"dict"`` zips them with
+    the column names. Date objects created by ``SQLITE_DETECT_TYPES`` are
+    turned back into ISO strings; with the default of ``none`` they are never
+    created and rows pass through untouched.
+    """
+    from .config import settings
+
+    if mode not in ("dict", "tuple"):
+        raise ValueError(f"Unsupported iter_query mode: {mode}")
+    cur, names = _tuple_cursor(conn, sql, params)
+    rows: Iterable[tuple] = cur
+    if detect_types_flags(settings.sqlite_detect_types):
+        rows = (tuple(map(_iso, row)) for row in cur)
+    if mode == "tuple":
+        yield from rows
+    else:
+        for row in rows:
+            yield dict(zip(names, row))
+
+
 def query(
-    conn: sqlite3.Connection, sql: str, params: Tuple[Any, ...] = ()
-) -> List[Dict[str, Any]]:
-    cur = conn.execute(sql, params)
+    conn: sqlite3.Connection, sql: str, params: Tuple[Any, ...] = (), mode: str = "dict"
+) -> Union[List[Dict[str, Any]], List[tuple], Dict[str, List[Any]]]:
+    """Fetch every row of a query.
+
+    ``"dict"`` and ``"tuple"`` return a list of rows as ``iter_query`` yields
+    them; ``"columns"`` returns ``{column: [values...]}`` in select order.
+    """
+    from .config import settings
+
+    if mode not in QUERY_MODES:
+        raise ValueError(f"Unsupported query mode: {mode}")
+    if mode != "columns":
+        return list(iter_query(conn, sql, params, mode))
+    cur, names = _tuple_cursor(conn, sql, params)
     rows = cur.fetchall()
-    return [_row_to_dict(r) for r in rows]
+    if detect_types_flags(settings.sqlite_detect_types):
+        rows = [tuple(map(_iso, row)) for row in rows]
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    return {name: list(values) for name, values in zip(names, columns)}
+
+
+@contextmanager
+def bulk_load(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Relax durability on ``conn`` for a large load, restoring the settings afterwards.
+
+    ``synchronous=OFF`` skips fsyncs; WAL still protects the file from
+    corruption, at the cost of possibly losing the last commits on power loss.
+    The journal mode of the main database stays WAL so API readers keep
+    working, while staging tables go to an unjournaled temp file instead of RAM.
+    """
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    temp_store = conn.execute("PRAGMA temp_store").fetchone()[0]
+    temp_journal_mode = conn.execute("PRAGMA temp.journal_mode").fetchone()[0]
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=FILE")
+    conn.execute("PRAGMA temp.journal_mode=OFF")
+    try:
+        yield conn
+    finally:
+        conn.execute(f"PRAGMA synchronous={int(synchronous)}")
+        conn.execute(f"PRAGMA temp_store={int(temp_store)}")
+        conn.execute(f"PRAGMA temp.journal_mode={temp_journal_mode}")
+
+
+def bulk_upsert(conn: sqlite3.Connection, table: str, columns: Sequence[str],
+                rows: Iterable[Tuple[Any, ...]], key: Sequence[str],
+                chunk_rows: Optional[int] = None) -> int:
+    """Load ``rows`` into ``table`` through a staging table, then merge them in one statement.
+
+    Rows are staged ``chunk_rows`` at a time, one transaction per chunk, so
+    memory stays bounded. The merge upserts on ``key`` in key order, and the
+    row staged last wins for duplicate keys, as with INSERT OR REPLACE. When
+    the load is at least as large as the table, its secondary indexes are
+    dropped for the merge and rebuilt afterwards inside the same transaction.
+    Returns the number of rows staged.
+    """
+    from .config import settings
+
+    chunk_rows = chunk_rows or settings.bulk_chunk_rows
+    staging = f"temp.bulk_{table}"
+    col_list = ", ".join(columns)
+    key_list = ", ".join(key)
+    conn.execute(f"DROP TABLE IF EXISTS {staging}")
+    conn.execute(f"CREATE TABLE {staging} AS SELECT {col_list} FROM main.{table} WHERE 0")
+    insert_sql = f"INSERT INTO {staging}({col_list}) VALUES({', '.join('?' * len(columns))})"
+
+    staged = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            break
+        with conn:
+            conn.executemany(insert_sql, chunk)
+        staged += len(chunk)
+
+    try:
+        if not staged:
+            return 0
+        existing = conn.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0]
+        indexes = []
+        if staged >= existing:
+            indexes = conn.execute(
+                "SELECT name, sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table,),
+            ).fetchall()
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in key)
+        conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+        conn.execute("BEGIN")
+        try:
+            for name, _ in indexes:
+                conn.execute(f"DROP INDEX main.{name}")
+            # WHERE true keeps the parser from reading ON CONFLICT as a join constraint
+            conn.execute(f"""
+                INSERT INTO main.{table}({col_list})
+                SELECT {col_list} FROM {staging} WHERE true
+                ORDER BY {key_list}, rowid
+                ON CONFLICT({key_list}) {conflict}
+            """)
+            for _, sql in indexes:
+                conn.execute(sql)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return staged
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS {staging}")
+
+
+def data_version(conn: sqlite3.Connection, name: str) -> int:
+    """Current version of the named data set; 0 if it has never been bumped."""
+    row = conn.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(conn: sqlite3.Connection, name: str) -> int:
+    """Mark the named data set as changed and return its new version."""
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO data_versions(name, version) VALUES(?, 1)
+            ON CONFLICT(name) DO UPDATE SET version = version + 1
+            """,
+            (name,),
+        )
+    return data_version(conn, name)
+
+
+def symbol_ids(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Ticker -> symbol_id for every row in ``stocks``."""
+    return {sym: sid for sid, sym in conn.execute("SELECT symbol_id, symbol FROM stocks")}
+
+
+def symbol_names(conn: sqlite3.Connection) -> Dict[int, str]:
+    """symbol_id -> ticker, used to decode ids at the API edge."""
+    return dict(conn.execute("SELECT symbol_id, symbol FROM stocks"))
@@ -2,34 +2,113 @@ from __future__ import annotations
 
 from typing import Any, Dict, List, Optional, Union
 from datetime import date
-import datetime as dt
+import calendar
+import os
+import tempfile
 
-from fastapi import FastAPI, HTTPException
+import orjson
+
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
-from .db import init_db
+from .db import init_db, pool, run_db, shutdown_db_executor
 from .cache import cache
+from .services.vectorized_engine import shutdown_build_pool
+from .services.build_jobs import build_jobs
+from .services.index_definitions import index_definitions
 from .services.index_service import (
-    build_index,
+    get_index_analytics,
     get_index_composition,
+    get_composition_range,
+    COMPOSITION_RANGE_FORMATS,
     get_index_performance,
+    get_index_performance_months,
+    performance_months,
     get_composition_changes,
+    backfill_composition_changes,
+    backfill_index_analytics,
+    iter_export_datasets,
+    DEFAULT_INDEX_ID,
+    EXPORT_DATASETS,
     _normalize_date,  # import for normalization
 )
-from .utils.exporter import export_excel_bytes
+from .utils.exporter import (
+    iter_csv,
+    iter_ndjson,
+    write_arrow_ipc,
+    write_excel_streaming,
+    write_parquet,
+)
 
 
 class BuildIndexRequest(BaseModel):
-    start_date: Union[str, date]
+    start_date: Optional[Union[str, date]] = None
     end_date: Optional[Union[str, date]] = None
+    engine: Optional[str] = None
+    incremental: bool = False
+    index_ids: Optional[List[str]] = None
 
 
 class ExportRequest(BaseModel):
     start_date: Union[str, date]
     end_date: Optional[Union[str, date]] = None
+    format: str = "xlsx"
+    dataset: Optional[str] = None
+    index_id: str = DEFAULT_INDEX_ID
+
+
+# formats written to a temp file first: format -> (writer, media type)
+EXPORT_FILE_FORMATS = {
+    "xlsx": (write_excel_streaming, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": (write_parquet, "application/vnd.apache.parquet"),
+    "arrow": (write_arrow_ipc, "application/vnd.apache.arrow.file"),
+}
+# formats streamed as they are produced: format -> (encoder, media type)
+EXPORT_STREAM_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+}
+SINGLE_DATASET_FORMATS = ("csv", "parquet", "arrow")
+
+
+def known_index_id(index_id: str = DEFAULT_INDEX_ID) -> str:
+    """The ``index_id`` of an index-scoped request, rejected with a 400 unless it is configured."""
+    if index_id not in index_definitions():
+        raise HTTPException(status_code=400, detail=f"Unknown index id: {index_id}")
+    return index_id
+
+
+def _json_response(payload: bytes) -> Response:
+    """Send already-encoded JSON bytes as they are."""
+    return Response(content=payload, media_type="application/json")
+
+
+async def _run_db_json(func, *args) -> bytes:
+    """Run a query function on the DB executor and encode its rows."""
+    return orjson.dumps(await run_db(func, *args))
 
 
-app = FastAPI(title="Equal-Weighted Top-100 Index API")
+def _stitch_months(months: List[str], segments: Dict[str, bytes], start_str: str, end_str: str) -> bytes:
+    """Join cached month arrays into one JSON array covering [start_str, end_str].
+
+    Months that lie entirely inside the range are spliced in as bytes; only
+    partially covered months at the edges are decoded and trimmed.
+    """
+    parts = []
+    for m in months:
+        payload = segments[m]
+        last_day = calendar.monthrange(int(m[:4]), int(m[5:]))[1]
+        if not (start_str <= f"{m}-01" and f"{m}-{last_day:02d}" <= end_str):
+            rows = [row for row in orjson.loads(payload) if start_str <= row["date"] <= end_str]
+            payload = orjson.dumps(rows)
+        if len(payload) > 2:
+            parts.append(payload[1:-1])
+    return b"[" + b",".join(parts) + b"]"
+
+
+app = FastAPI(title="Equal-Weighted Top-100 Index API", default_response_class=ORJSONResponse)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -49,77 +128,143 @@ app.add_middleware(
 @app.on_event("startup")
 def startup() -> None:
     init_db()
+    backfill_composition_changes()
+    backfill_index_analytics()
+    cache.start_listener()
+    build_jobs.start()
 
 
-@app.post("/build-index")
-def api_build_index(req: BuildIndexRequest):
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await cache.aclose()
+    build_jobs.shutdown()
+    shutdown_db_executor()
+    shutdown_build_pool()
+    pool.close()
+
+
+@app.post("/build-index", status_code=202)
+async def api_build_index(req: BuildIndexRequest):
+    """Queue a build; poll /build-jobs/{job_id} for its progress and result."""
     try:
-        return build_index(req.start_date, req.end_date)
+        job, _ = build_jobs.submit(req.start_date, req.end_date, req.engine, req.incremental, req.index_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job
+
+
+@app.get("/build-jobs/{job_id}")
+async def api_build_job(job_id: str):
+    job = build_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown build job: {job_id}")
+    return job
+
+
+@app.get("/index-performance", response_model=List[Dict[str, Any]])
+async def api_index_performance(
+    start_date: Union[str, date], end_date: Optional[Union[str, date]] = None,
+    index_id: str = Depends(known_index_id),
+):
+    try:
+        start_str = _normalize_date(start_date)
+        end_str = _normalize_date(end_date) or start_str
+
+        # cached per calendar month so overlapping ranges share segments
+        months = performance_months(start_str, end_str)
+        if months is None:
+            rows = await run_db(get_index_performance, start_str, end_str, index_id)
+            return _json_response(orjson.dumps(rows))
+
+        prefix = f"perf:m:{index_id}:"
+
+        async def load_months(keys: List[str]) -> Dict[str, bytes]:
+            loaded = await run_db(get_index_performance_months, [k[len(prefix):] for k in keys], index_id)
+            return {f"{prefix}{m}": orjson.dumps(rows) for m, rows in loaded.items()}
+
+        payloads = await cache.aget_or_fill_many_raw([f"{prefix}{m}" for m in months], load_months, 3600)
+        segments = dict(zip(months, payloads))
+        return _json_response(_stitch_months(months, segments, start_str, end_str))
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/index-performance")
-def api_index_performance(
-    start_date: Union[str, date], end_date: Optional[Union[str, date]] = None
-) -> List[Dict[str, Any]]:
+@app.get("/index-analytics", response_model=List[Dict[str, Any]])
+async def api_index_analytics(
+    start_date: Union[str, date], end_date: Optional[Union[str, date]] = None,
+    index_id: str = Depends(known_index_id),
+):
     try:
         start_str = _normalize_date(start_date)
         end_str = _normalize_date(end_date) or start_str
 
-        cache_key = f"perf:{start_str}:{end_str}"
-        cached = cache.get_json(cache_key)
-        if cached is not None:
-            return cached
-
-        import time
-        time.sleep(0.5)  # simulate heavy DB query
-        rows = get_index_performance(start_date, end_date)
-
-        cache.set_json(cache_key, rows, 3600)
-        return rows
+        payload = await cache.aget_or_fill_raw(
+            f"analytics:{index_id}:{start_str}:{end_str}",
+            lambda: _run_db_json(get_index_analytics, start_str, end_str, index_id),
+            3600,
+        )
+        return _json_response(payload)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/index-composition")
-def api_index_composition(date: Union[str, date]) -> List[Dict[str, Any]]:
+@app.get("/index-composition", response_model=List[Dict[str, Any]])
+async def api_index_composition(date: Union[str, date], index_id: str = Depends(known_index_id)):
     try:
         date_str = _normalize_date(date)
-        cache_key = f"compo:{date_str}"
-        cached = cache.get_json(cache_key)
-        if cached is not None:
-            return cached
-
-        rows = get_index_composition(date_str)
-        cache.set_json(cache_key, rows, 3600)
-        return rows
+        payload = await cache.aget_or_fill_raw(
+            f"compo:{index_id}:{date_str}",
+            lambda: _run_db_json(get_index_composition, date_str, index_id),
+            3600,
+        )
+        return _json_response(payload)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/composition-changes")
-def api_composition_changes(
-    start_date: Union[str, date], end_date: Union[str, date]
-) -> List[Dict[str, Any]]:
+@app.get("/index-composition-range", response_model=Dict[str, Any])
+async def api_index_composition_range(
+    start_date: Union[str, date], end_date: Union[str, date], format: str = "delta",
+    index_id: str = Depends(known_index_id),
+):
+    if format not in COMPOSITION_RANGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported composition range format: {format}")
     try:
         start_str = _normalize_date(start_date)
         end_str = _normalize_date(end_date)
 
-        cache_key = f"changes:{start_str}:{end_str}"
-        cached = cache.get_json(cache_key)
-        if cached is not None:
-            return cached
+        payload = await cache.aget_or_fill_raw(
+            f"compo-range:{index_id}:{format}:{start_str}:{end_str}",
+            lambda: _run_db_json(get_composition_range, start_str, end_str, format, index_id),
+            3600,
+        )
+        return _json_response(payload)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
 
-        rows = get_composition_changes(start_str, end_str)
-        cache.set_json(cache_key, rows, 3600)
-        return rows
+
+@app.get("/composition-changes", response_model=List[Dict[str, Any]])
+async def api_composition_changes(
+    start_date: Union[str, date], end_date: Union[str, date], index_id: str = Depends(known_index_id)
+):
+    try:
+        start_str = _normalize_date(start_date)
+        end_str = _normalize_date(end_date)
+
+        payload = await cache.aget_or_fill_raw(
+            f"changes:{index_id}:{start_str}:{end_str}",
+            lambda: _run_db_json(get_composition_changes, start_str, end_str, None, index_id),
+            3600,
+        )
+        return _json_response(payload)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -127,30 +272,42 @@ def api_composition_changes(
 
 
 @app.post("/export-data")
-def api_export(req: ExportRequest):
+async def api_export(req: ExportRequest):
     start = req.start_date
     end = req.end_date or start
-
-    perf = get_index_performance(start, end)
-    start_dt = start if isinstance(start, date) else dt.date.fromisoformat(str(start))
-    end_dt = end if isinstance(end, date) else dt.date.fromisoformat(str(end))
-
-    dates = [start_dt + dt.timedelta(days=i) for i in range((end_dt - start_dt).days + 1)]
-    compo_rows: List[Dict[str, Any]] = []
-    for d in dates:
-        rows = get_index_composition(d)
-        for r in rows:
-            compo_rows.append({"date": d.isoformat(), **r})
-
-    changes = get_composition_changes(start, end)
-
-    xlsx_bytes = export_excel_bytes(perf, compo_rows, changes)
-    from fastapi.responses import Response
-
-    return Response(
-        content=xlsx_bytes,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    fmt = req.format.lower()
+
+    if fmt not in EXPORT_FILE_FORMATS and fmt not in EXPORT_STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {req.format}")
+    if req.dataset is not None and req.dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export dataset: {req.dataset}")
+    if fmt in SINGLE_DATASET_FORMATS and req.dataset is None:
+        raise HTTPException(status_code=400, detail=f"{fmt} export needs a dataset")
+    known_index_id(req.index_id)
+    datasets = [req.dataset] if req.dataset else list(EXPORT_DATASETS)
+
+    if fmt in EXPORT_FILE_FORMATS:
+        # these formats are finalised on close, so stream them from a temp file
+        writer, media_type = EXPORT_FILE_FORMATS[fmt]
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+        os.close(fd)
+        try:
+            await run_db(writer, path, iter_export_datasets(datasets, start, end, req.index_id))
+        except Exception:
+            os.remove(path)
+            raise
+        return FileResponse(
+            path,
+            media_type=media_type,
+            filename=f"index_export.{fmt}",
+            background=BackgroundTask(os.remove, path),
+        )
+
+    encoder, media_type = EXPORT_STREAM_FORMATS[fmt]
+    return StreamingResponse(
+        encoder(iter_export_datasets(datasets, start, end, req.index_id)),
+        media_type=media_type,
         headers={
-            "Content-Disposition": "attachment; filename=index_export.xlsx"
+            "Content-Disposition": f"attachment; filename=index_export.{fmt}"
         },
     )
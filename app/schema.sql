@@ -1,47 +1,77 @@
 PRAGMA foreign_keys = ON;
 
 CREATE TABLE IF NOT EXISTS stocks (
-    symbol TEXT PRIMARY KEY,
+    symbol_id INTEGER PRIMARY KEY,
+    symbol TEXT NOT NULL UNIQUE,
     name TEXT,
     sector TEXT,
     industry TEXT,
-    exchange TEXT
+    exchange TEXT,
+    shares_outstanding INTEGER
 );
 
 CREATE TABLE IF NOT EXISTS daily_prices (
-    symbol TEXT NOT NULL,
+    symbol_id INTEGER NOT NULL,
     date DATE NOT NULL,
     close REAL,
     adj_close REAL,
     volume INTEGER,
-    PRIMARY KEY (symbol, date),
-    FOREIGN KEY (symbol) REFERENCES stocks(symbol) ON DELETE CASCADE
-);
+    PRIMARY KEY (symbol_id, date),
+    FOREIGN KEY (symbol_id) REFERENCES stocks(symbol_id) ON DELETE CASCADE
+) WITHOUT ROWID;
 
 CREATE TABLE IF NOT EXISTS daily_market_caps (
-    symbol TEXT NOT NULL,
+    symbol_id INTEGER NOT NULL,
     date DATE NOT NULL,
     market_cap REAL NOT NULL,
-    PRIMARY KEY (symbol, date),
-    FOREIGN KEY (symbol) REFERENCES stocks(symbol) ON DELETE CASCADE
-);
+    PRIMARY KEY (symbol_id, date),
+    FOREIGN KEY (symbol_id) REFERENCES stocks(symbol_id) ON DELETE CASCADE
+) WITHOUT ROWID;
 
+-- index tables are keyed by index_id, one per configured index definition
 CREATE TABLE IF NOT EXISTS index_compositions (
+    index_id TEXT NOT NULL DEFAULT 'top100',
     date DATE NOT NULL,
-    symbol TEXT NOT NULL,
+    symbol_id INTEGER NOT NULL,
     weight REAL NOT NULL,
-    PRIMARY KEY (date, symbol),
-    FOREIGN KEY (symbol) REFERENCES stocks(symbol) ON DELETE CASCADE
-);
+    PRIMARY KEY (index_id, date, symbol_id),
+    FOREIGN KEY (symbol_id) REFERENCES stocks(symbol_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS index_composition_changes (
+    index_id TEXT NOT NULL DEFAULT 'top100',
+    date DATE NOT NULL,
+    symbol_id INTEGER NOT NULL,
+    action TEXT NOT NULL CHECK (action IN ('entered', 'exited')),
+    PRIMARY KEY (index_id, date, symbol_id),
+    FOREIGN KEY (symbol_id) REFERENCES stocks(symbol_id) ON DELETE CASCADE
+) WITHOUT ROWID;
 
 CREATE TABLE IF NOT EXISTS index_performance (
-    date DATE PRIMARY KEY,
+    index_id TEXT NOT NULL DEFAULT 'top100',
+    date DATE NOT NULL,
     daily_return REAL NOT NULL,
     cumulative_return REAL NOT NULL,
-    index_level REAL NOT NULL
+    index_level REAL NOT NULL,
+    PRIMARY KEY (index_id, date)
+);
+
+-- derived from index_performance and index_compositions by build_index
+CREATE TABLE IF NOT EXISTS index_analytics (
+    index_id TEXT NOT NULL DEFAULT 'top100',
+    date DATE NOT NULL,
+    volatility REAL,            -- annualized, over the trailing ANALYTICS_WINDOW_DAYS returns
+    peak_level REAL NOT NULL,
+    drawdown REAL NOT NULL,     -- index_level / peak_level - 1
+    turnover REAL,              -- one-way, against the previous stored day
+    PRIMARY KEY (index_id, date)
+);
+
+-- bumped by every writer of a data set, so derived copies can tell they are stale
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
 );
 
 CREATE INDEX IF NOT EXISTS idx_prices_date ON daily_prices(date);
 CREATE INDEX IF NOT EXISTS idx_mcaps_date ON daily_market_caps(date);
-CREATE INDEX IF NOT EXISTS idx_compo_date ON index_compositions(date);
-
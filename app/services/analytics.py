@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import math
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TRADING_DAYS_PER_YEAR = 252
+
+# (date, volatility, peak_level, drawdown, turnover), as stored in index_analytics
+AnalyticsRow = Tuple[str, Optional[float], float, float, Optional[float]]
+
+
+def daily_weights(rows: Iterable[tuple]) -> Iterator[Tuple[str, Dict[int, float]]]:
+    """Group ``(date, symbol_id, weight)`` rows ordered by date into ``(date, {symbol_id: weight})``."""
+    for d, group in groupby(rows, key=itemgetter(0)):
+        yield d, {sid: weight for _, sid, weight in group}
+
+
+def turnover(previous: Dict[int, float], current: Dict[int, float]) -> float:
+    """One-way turnover: half the summed absolute weight changes between two days."""
+    return 0.5 * sum(
+        abs(current.get(sid, 0.0) - previous.get(sid, 0.0)) for sid in previous.keys() | current.keys()
+    )
+
+
+class RollingAnalytics:
+    """Extends the analytics series by one day at a time in constant time.
+
+    Keeps the trailing ``window_days`` daily returns with their running sum
+    and sum of squares for the rolling volatility, the running peak level for
+    drawdowns, and the previous day's weights for turnover. Seed it with the
+    state just before the first day to continue an existing series.
+    """
+
+    def __init__(self, window_days: int, returns: Iterable[float] = (),
+                 peak: Optional[float] = None, weights: Optional[Dict[int, float]] = None) -> None:
+        self.window_days = window_days
+        self._window: Deque[float] = deque()
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        for r in returns:
+            self._push(r)
+        self.peak = peak
+        self.weights = weights
+
+    def _push(self, daily_return: float) -> None:
+        if len(self._window) == self.window_days:
+            old = self._window.popleft()
+            self._sum -= old
+            self._sum_sq -= old * old
+        self._window.append(daily_return)
+        self._sum += daily_return
+        self._sum_sq += daily_return * daily_return
+
+    def volatility(self) -> Optional[float]:
+        """Annualized sample standard deviation of the window, None until it is full."""
+        n = len(self._window)
+        if n < max(self.window_days, 2):
+            return None
+        variance = (self._sum_sq - self._sum * self._sum / n) / (n - 1)
+        return math.sqrt(max(variance, 0.0) * TRADING_DAYS_PER_YEAR)
+
+    def step(self, date: str, daily_return: float, index_level: float,
+             weights: Optional[Dict[int, float]] = None,
+             stored_turnover: Optional[float] = None) -> AnalyticsRow:
+        """Add one day. Without ``weights`` the day's turnover is ``stored_turnover``."""
+        self._push(daily_return)
+        self.peak = index_level if self.peak is None else max(self.peak, index_level)
+        if weights is None:
+            day_turnover = stored_turnover
+        elif self.weights is None:
+            day_turnover = None
+        else:
+            day_turnover = turnover(self.weights, weights)
+        self.weights = weights
+        return date, self.volatility(), self.peak, index_level / self.peak - 1.0, day_turnover
+
+
+def analytics_rows(state: RollingAnalytics,
+                   performance: Iterable[tuple],
+                   weights: Iterable[Tuple[str, Dict[int, float]]]) -> List[AnalyticsRow]:
+    """Run ``state`` over ``(date, daily_return, index_level, stored_turnover)`` rows.
+
+    ``weights`` is a date-ordered ``(date, weights)`` stream, merged in as the
+    performance rows advance; days it has no entry for keep their stored
+    turnover.
+    """
+    weights = iter(weights)
+    pending = next(weights, None)
+    rows: List[AnalyticsRow] = []
+    for d, daily_return, index_level, stored_turnover in performance:
+        while pending is not None and pending[0] < d:
+            pending = next(weights, None)
+        day_weights = pending[1] if pending is not None and pending[0] == d else None
+        rows.append(state.step(d, daily_return, index_level, day_weights, stored_turnover))
+    return rows
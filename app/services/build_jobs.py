@@ -0,0 +1,162 @@
+"""Background queue that runs ``build_index`` requests one at a time.
+
+``/build-index`` only enqueues a job and returns its id; a single worker
+thread takes jobs in order and runs each build to completion, so builds in
+this process never overlap on the writer connection. A request equal to one
+that is still waiting joins that job instead of queueing a second build.
+Running and finished jobs are never joined: their data may predate the new
+request. Jobs live in memory; the most recent ``build_job_history`` finished
+ones are kept for status queries. The app calls ``start`` on startup and
+``shutdown`` on shutdown, and the pair can repeat in one process.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import threading
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from ..config import settings
+from .index_service import BuildRequest, build_request, run_build
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+
+
+def _now() -> str:
+    return dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds")
+
+
+class BuildJob:
+    """One queued build with its progress and, once finished, its result or error."""
+
+    def __init__(self, request: BuildRequest) -> None:
+        self.job_id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"
+        self.days_processed = 0
+        self.days_total: Optional[int] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = _now()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "request": {**self.request._asdict(), "index_ids": list(self.request.index_ids)},
+            "days_processed": self.days_processed,
+            "days_total": self.days_total,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class BuildJobQueue:
+    """FIFO of build jobs served by one lazily started worker thread."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._jobs: "OrderedDict[str, BuildJob]" = OrderedDict()
+        self._queue: Deque[BuildJob] = deque()
+        self._queued_by_request: Dict[BuildRequest, BuildJob] = {}
+        self._worker: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def submit(self, start_date: Optional[Union[str, dt.date]],
+               end_date: Optional[Union[str, dt.date]] = None,
+               engine: Optional[str] = None,
+               incremental: bool = False,
+               index_ids: Optional[List[str]] = None) -> Tuple[Dict[str, Any], bool]:
+        """Queue a build and return ``(job, created)``.
+
+        Arguments are validated up front, raising ValueError like
+        ``build_index``. ``created`` is False when an identical request was
+        already waiting and its job is returned instead.
+        """
+        request = build_request(start_date, end_date, engine, incremental, index_ids)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("The build queue is shutting down")
+            job = self._queued_by_request.get(request)
+            if job is not None:
+                return job.to_dict(), False
+            job = BuildJob(request)
+            self._jobs[job.job_id] = job
+            self._queue.append(job)
+            self._queued_by_request[request] = job
+            self._ensure_worker()
+            self._cond.notify()
+            return job.to_dict(), True
+
+    def start(self) -> None:
+        """Accept jobs again after a ``shutdown``."""
+        with self._cond:
+            self._stopping = False
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="build-jobs", daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                job = self._queue.popleft()
+                del self._queued_by_request[job.request]
+                job.status = "running"
+                job.started_at = _now()
+
+            def progress(days_processed: int, days_total: int) -> None:
+                with self._cond:
+                    job.days_processed, job.days_total = days_processed, days_total
+
+            try:
+                result = run_build(job.request, progress)
+            except Exception as e:
+                traceback.print_exc()
+                status, result, error = "failed", None, str(e)
+            else:
+                status, error = "succeeded", None
+            with self._cond:
+                job.status, job.result, job.error = status, result, error
+                job.finished_at = _now()
+                self._forget_finished()
+
+    def _forget_finished(self) -> None:
+        """Drop the oldest finished jobs beyond ``settings.build_job_history``."""
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        for job in finished[:max(len(finished) - settings.build_job_history, 0)]:
+            del self._jobs[job.job_id]
+
+    def shutdown(self) -> None:
+        """Stop taking jobs and wait for a running build to finish; queued jobs fail."""
+        with self._cond:
+            self._stopping = True
+            while self._queue:
+                job = self._queue.popleft()
+                job.status, job.error, job.finished_at = "failed", "The build queue shut down", _now()
+            self._queued_by_request.clear()
+            self._forget_finished()
+            self._cond.notify_all()
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.join()
+
+
+build_jobs = BuildJobQueue()
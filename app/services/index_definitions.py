@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import json
+from typing import Dict, NamedTuple, Optional
+
+from ..config import settings
+
+DEFAULT_INDEX_ID = "top100"
+WEIGHTINGS = ("equal", "cap")
+
+
+class IndexDefinition(NamedTuple):
+    """One index variant built by ``build_index``.
+
+    Each day holds the ``top_n`` largest stocks by market cap, weighted
+    equally or by market cap. With ``sector_cap`` set, no sector's total
+    weight may exceed it; the excess is spread over the other sectors.
+    """
+
+    index_id: str
+    top_n: int = 100
+    weighting: str = "equal"
+    sector_cap: Optional[float] = None
+
+    @property
+    def equal_weighted(self) -> bool:
+        """True when every member has the same weight each day."""
+        return self.weighting == "equal" and self.sector_cap is None
+
+
+def index_definitions() -> Dict[str, IndexDefinition]:
+    """Configured index definitions by id, in ``INDEX_DEFINITIONS`` order.
+
+    ``INDEX_DEFINITIONS`` is a JSON list of objects with the fields of
+    ``IndexDefinition``; when it is unset only the equal-weighted top 100 is
+    built, under ``DEFAULT_INDEX_ID``.
+    """
+    raw = settings.index_definitions
+    specs = json.loads(raw) if raw else [{"index_id": DEFAULT_INDEX_ID}]
+    definitions: Dict[str, IndexDefinition] = {}
+    for spec in specs:
+        try:
+            definition = IndexDefinition(**spec)
+        except TypeError as e:
+            raise ValueError(f"Invalid index definition {spec}: {e}") from None
+        if definition.index_id in definitions:
+            raise ValueError(f"Duplicate index id: {definition.index_id}")
+        if definition.weighting not in WEIGHTINGS:
+            raise ValueError(f"Unsupported index weighting: {definition.weighting}")
+        if definition.top_n < 1:
+            raise ValueError(f"top_n must be positive for index {definition.index_id}")
+        if definition.sector_cap is not None and not 0 < definition.sector_cap <= 1:
+            raise ValueError(f"sector_cap must be in (0, 1] for index {definition.index_id}")
+        definitions[definition.index_id] = definition
+    return definitions
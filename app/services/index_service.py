@@ -1,10 +1,19 @@
 from __future__ import annotations
 
 import datetime as dt
-from typing import Any, Dict, List, Optional, Union
-
-from ..db import get_connection, execute_many, query
+import os
+from collections import deque
+from itertools import chain, groupby
+from operator import itemgetter
+from typing import Any, Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from ..db import bulk_load, get_connection, iter_query, pool, query, symbol_names
+from ..cache import cache
+from ..columnar_store import open_store
 from ..config import settings
+from .analytics import RollingAnalytics, analytics_rows, daily_weights
+from .index_definitions import DEFAULT_INDEX_ID, IndexDefinition, index_definitions
+from .vectorized_engine import IndexCheckpoint, compute_indexes_vectorized
 
 
 def _normalize_date(d: Union[str, dt.date, None]) -> Optional[str]:
@@ -26,14 +35,59 @@ def safe_parse_date(val):
     raise ValueError(f"Unsupported date format: {type(val)}")
 
 
-def build_index(start_date: Union[str, dt.date],
-                end_date: Optional[Union[str, dt.date]] = None) -> Dict[str, Any]:
-    start_date_str = _normalize_date(start_date)
-    end_date_str = _normalize_date(end_date) or start_date_str
+INDEX_ENGINES = ("loop", "vectorized", "parallel")
+
+# progress(days_processed, days_total), called from the building thread
+ProgressCallback = Callable[[int, int], None]
+
+
+def _load_checkpoint(conn, index_id: str, before_date_str: Optional[str]) -> Optional[IndexCheckpoint]:
+    """Return an index's last stored performance row (strictly before a date,
+    if given) together with its composition snapshot."""
+    if before_date_str is None:
+        rows = query(
+            conn,
+            """
+            SELECT date, index_level
+            FROM index_performance
+            WHERE index_id = ?
+            ORDER BY date DESC
+            LIMIT 1
+            """,
+            (index_id,),
+        )
+    else:
+        rows = query(
+            conn,
+            """
+            SELECT date, index_level
+            FROM index_performance
+            WHERE index_id = ? AND date < ?
+            ORDER BY date DESC
+            LIMIT 1
+            """,
+            (index_id, before_date_str),
+        )
+    if not rows:
+        return None
+    date_str = rows[0]["date"]
+    symbols = query(
+        conn,
+        "SELECT symbol_id FROM index_compositions WHERE index_id = ? AND date = ?",
+        (index_id, date_str),
+        mode="columns",
+    )
+    return IndexCheckpoint(
+        date=date_str,
+        index_level=rows[0]["index_level"],
+        symbols=frozenset(symbols["symbol_id"]),
+    )
 
-    conn = get_connection()
 
-    dates_rows = query(
+def _compute_index_loop(conn, start_date_str: str, end_date_str: str,
+                        checkpoint: Optional[IndexCheckpoint] = None, top_n: int = 100,
+                        on_day: Optional[Callable[[], None]] = None):
+    dates_rows = iter_query(
         conn,
         """
         SELECT DISTINCT date
@@ -42,47 +96,52 @@ def build_index(start_date: Union[str, dt.date],
         ORDER BY date
         """,
         (start_date_str, end_date_str),
+        mode="tuple",
     )
 
     # Fix: parse safely to handle both str and date from DB
-    trading_dates = [safe_parse_date(r["date"]) for r in dates_rows]
-
-    if not trading_dates:
-        conn.close()
-        return {"status": "error", "message": "No trading days in range"}
+    trading_dates = [safe_parse_date(d) for (d,) in dates_rows]
 
     compositions: List[tuple] = []
     perf_rows: List[tuple] = []
 
-    index_level = settings.index_base_level
+    index_level = checkpoint.index_level if checkpoint else settings.index_base_level
     cumulative_return = 0.0
 
+    # Returns only need the previous trading day's constituents, so keep a
+    # bounded window of per-day sets instead of rescanning ``compositions``.
+    recent: Deque[Tuple[str, FrozenSet[int]]] = deque(maxlen=1)
+    if checkpoint is not None:
+        recent.append((checkpoint.date, checkpoint.symbols))
+
     for current_date in trading_dates:
         top_rows = query(
             conn,
             """
-            SELECT symbol, market_cap
+            SELECT symbol_id, market_cap
             FROM daily_market_caps
             WHERE date = ?
             ORDER BY market_cap DESC
-            LIMIT 100
+            LIMIT ?
             """,
-            (current_date.isoformat(),),
+            (current_date.isoformat(), top_n),
+            mode="tuple",
         )
 
         if not top_rows:
+            if on_day:
+                on_day()
             continue
 
         weight = 1.0 / len(top_rows)
 
-        for r in top_rows:
-            compositions.append((current_date.isoformat(), r["symbol"], weight))
+        for sid, _ in top_rows:
+            compositions.append((current_date.isoformat(), sid, weight))
 
-        if perf_rows:
-            prev_date = perf_rows[-1][0]
-            prev_symbols = {sym for d, sym, _ in compositions if d == prev_date}
-            curr_symbols = {sym for sym, _ in [(r["symbol"], r["market_cap"]) for r in top_rows]}
+        curr_symbols = frozenset(sid for sid, _ in top_rows)
 
+        if recent:
+            prev_date, prev_symbols = recent[-1]
             common_syms = prev_symbols & curr_symbols
             if common_syms:
                 returns = []
@@ -92,13 +151,14 @@ def build_index(start_date: Union[str, dt.date],
                         """
                         SELECT adj_close
                         FROM daily_prices
-                        WHERE symbol = ? AND date IN (?, ?)
+                        WHERE symbol_id = ? AND date IN (?, ?)
                         ORDER BY date
                         """,
                         (sym, prev_date, current_date.isoformat()),
+                        mode="tuple",
                     )
-                    if len(prices) == 2 and prices[0]["adj_close"] and prices[1]["adj_close"]:
-                        ret = (prices[1]["adj_close"] / prices[0]["adj_close"]) - 1.0
+                    if len(prices) == 2 and prices[0][0] and prices[1][0]:
+                        ret = (prices[1][0] / prices[0][0]) - 1.0
                         returns.append(ret)
                 daily_return = sum(returns) / len(returns) if returns else 0.0
             else:
@@ -110,98 +170,643 @@ def build_index(start_date: Union[str, dt.date],
         cumulative_return = (index_level / settings.index_base_level) - 1.0
 
         perf_rows.append((current_date.isoformat(), daily_return, cumulative_return, index_level))
+        recent.append((current_date.isoformat(), curr_symbols))
+        if on_day:
+            on_day()
+
+    return trading_dates, compositions, perf_rows
+
 
-    execute_many(
+def _snapshot(conn, index_id: str, date_sql: str,
+              params: Tuple[Any, ...]) -> Optional[Tuple[str, Dict[int, float]]]:
+    """Stored weights of an index for the date picked by ``date_sql`` (a scalar
+    subquery, whose parameters follow ``index_id`` in ``params``)."""
+    rows = query(
         conn,
-        "INSERT OR REPLACE INTO index_compositions(date, symbol, weight) VALUES(?, ?, ?)",
-        compositions
+        f"SELECT date, symbol_id, weight FROM index_compositions WHERE index_id = ? AND date = ({date_sql})",
+        (index_id, *params),
+        mode="tuple",
     )
-    execute_many(
+    if not rows:
+        return None
+    return rows[0][0], {sid: weight for _, sid, weight in rows}
+
+
+def _analytics_state(conn, index_id: str, first_date_str: str,
+                     weights: Optional[Dict[int, float]]) -> RollingAnalytics:
+    """Rolling analytics state of an index as of its last stored day before ``first_date_str``."""
+    window_days = settings.analytics_window_days
+    returns = query(
         conn,
-        "INSERT OR REPLACE INTO index_performance(date, daily_return, cumulative_return, index_level) VALUES(?, ?, ?, ?)",
-        perf_rows
+        """
+        SELECT daily_return FROM index_performance
+        WHERE index_id = ? AND date < ?
+        ORDER BY date DESC
+        LIMIT ?
+        """,
+        (index_id, first_date_str, window_days - 1),
+        mode="columns",
+    )["daily_return"]
+    # the stored peak of the previous day, or the maximum level if analytics were never stored
+    peak = query(
+        conn,
+        """
+        SELECT COALESCE(
+            (SELECT peak_level FROM index_analytics
+             WHERE index_id = :index_id AND date = (
+                 SELECT MAX(date) FROM index_performance WHERE index_id = :index_id AND date < :first
+             )),
+            (SELECT MAX(index_level) FROM index_performance WHERE index_id = :index_id AND date < :first)
+        )
+        """,
+        {"index_id": index_id, "first": first_date_str},
+        mode="tuple",
+    )[0][0]
+    return RollingAnalytics(window_days, reversed(returns), peak, weights)
+
+
+def _store_analytics(conn, index_id: str, first_date_str: str, compositions: Iterable[tuple],
+                     before: Optional[Tuple[str, Dict[int, float]]],
+                     following: Optional[Tuple[str, Dict[int, float]]]) -> None:
+    """Recompute an index's analytics from ``first_date_str`` through its last stored day.
+
+    Days from ``compositions`` (date-ordered) and the ``following`` snapshot
+    get their turnover recomputed; later days only have their rolling values
+    and drawdowns carried forward and keep their stored turnover.
+    """
+    state = _analytics_state(conn, index_id, first_date_str, before[1] if before else None)
+    performance = iter_query(
+        conn,
+        """
+        SELECT p.date, p.daily_return, p.index_level, a.turnover
+        FROM index_performance p
+        LEFT JOIN index_analytics a ON a.index_id = p.index_id AND a.date = p.date
+        WHERE p.index_id = ? AND p.date >= ?
+        ORDER BY p.date
+        """,
+        (index_id, first_date_str),
+        mode="tuple",
+    )
+    weights = chain(daily_weights(compositions), [following] if following else [])
+    rows = analytics_rows(state, performance, weights)
+    conn.execute(
+        "DELETE FROM index_analytics WHERE index_id = ? AND date >= ?", (index_id, first_date_str)
     )
+    conn.executemany(
+        "INSERT INTO index_analytics(index_id, date, volatility, peak_level, drawdown, turnover) VALUES(?, ?, ?, ?, ?, ?)",
+        ((index_id, *row) for row in rows),
+    )
+
+
+def _composition_change_rows(compositions: List[tuple],
+                             previous: Optional[FrozenSet[int]]) -> List[tuple]:
+    """Diff consecutive days of ``(date, symbol_id, weight)`` rows into change rows."""
+    rows: List[tuple] = []
+    for d, group in groupby(compositions, key=itemgetter(0)):
+        current = frozenset(sid for _, sid, _ in group)
+        if previous is not None:
+            rows.extend((d, sid, "entered") for sid in current - previous)
+            rows.extend((d, sid, "exited") for sid in previous - current)
+        previous = current
+    return rows
+
+
+def _store_build(conn, index_id: str, compositions: List[tuple], perf_rows: List[tuple],
+                 checkpoint: Optional[IndexCheckpoint]) -> None:
+    """Replace an index's built date range and keep its index_composition_changes
+    and index_analytics in step.
+
+    The first built day is diffed against the stored day before it and the
+    stored day right after the range is re-diffed against the last built day,
+    so the persisted changes stay consistent around partial rebuilds.
+    Analytics are recomputed from the first built day onwards.
+    """
+    first_date, last_date = perf_rows[0][0], perf_rows[-1][0]
+    # key order appends to the WITHOUT ROWID b-tree instead of splitting pages
+    compositions = sorted(compositions)
+    before = _snapshot(
+        conn, index_id,
+        "SELECT MAX(date) FROM index_compositions WHERE index_id = ? AND date < ?",
+        (index_id, first_date),
+    )
+    if checkpoint is not None:
+        previous = checkpoint.symbols
+    else:
+        previous = frozenset(before[1]) if before else None
+    following = _snapshot(
+        conn, index_id,
+        "SELECT MIN(date) FROM index_compositions WHERE index_id = ? AND date > ?",
+        (index_id, last_date),
+    )
+
+    changes = _composition_change_rows(compositions, previous)
+    if following is not None:
+        last_symbols = frozenset(sid for d, sid, _ in compositions if d == last_date)
+        changes.extend(_composition_change_rows(
+            [(following[0], sid, None) for sid in following[1]], last_symbols
+        ))
+        change_range = (first_date, following[0])
+    else:
+        change_range = (first_date, last_date)
+
+    with bulk_load(conn), conn:
+        conn.execute(
+            "DELETE FROM index_compositions WHERE index_id = ? AND date BETWEEN ? AND ?",
+            (index_id, first_date, last_date),
+        )
+        conn.execute(
+            "DELETE FROM index_composition_changes WHERE index_id = ? AND date BETWEEN ? AND ?",
+            (index_id, *change_range),
+        )
+        conn.executemany(
+            "INSERT INTO index_compositions(index_id, date, symbol_id, weight) VALUES(?, ?, ?, ?)",
+            ((index_id, *row) for row in compositions),
+        )
+        conn.executemany(
+            "INSERT INTO index_composition_changes(index_id, date, symbol_id, action) VALUES(?, ?, ?, ?)",
+            ((index_id, *row) for row in changes),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO index_performance(index_id, date, daily_return, cumulative_return, index_level) VALUES(?, ?, ?, ?, ?)",
+            ((index_id, *row) for row in perf_rows),
+        )
+        _store_analytics(conn, index_id, first_date, compositions, before, following)
+
+
+class BuildRequest(NamedTuple):
+    """A validated ``build_index`` request; equal requests build the same thing."""
+
+    start_date: Optional[str]
+    end_date: Optional[str]
+    engine: str
+    incremental: bool
+    index_ids: Tuple[str, ...]
+
+
+def build_request(start_date: Optional[Union[str, dt.date]],
+                  end_date: Optional[Union[str, dt.date]] = None,
+                  engine: Optional[str] = None,
+                  incremental: bool = False,
+                  index_ids: Optional[List[str]] = None) -> BuildRequest:
+    """Check ``build_index`` arguments and fill in the defaults, raising ValueError if invalid."""
+    start_date_str = _normalize_date(start_date)
+    engine = engine or settings.index_engine
+    if engine not in INDEX_ENGINES:
+        raise ValueError(f"Unsupported index engine: {engine}")
+    if start_date_str is None and not incremental:
+        raise ValueError("start_date is required unless incremental=True")
+    definitions = index_definitions()
+    for index_id in index_ids or []:
+        if index_id not in definitions:
+            raise ValueError(f"Unknown index id: {index_id}")
+    selected = tuple(dict.fromkeys(index_ids)) if index_ids else tuple(definitions)
+    if engine == "loop":
+        for index_id in selected:
+            if not definitions[index_id].equal_weighted:
+                raise ValueError(f"The loop engine only builds equal-weighted indexes, not {index_id}")
+    return BuildRequest(start_date_str, _normalize_date(end_date), engine, incremental, selected)
+
+
+def build_index(start_date: Optional[Union[str, dt.date]],
+                end_date: Optional[Union[str, dt.date]] = None,
+                engine: Optional[str] = None,
+                incremental: bool = False,
+                index_ids: Optional[List[str]] = None,
+                progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Compute and store index compositions and performance for a date range.
+
+    Every configured index definition is built, or only those in
+    ``index_ids``, all from one load of the market data. A full build starts
+    each index at ``settings.index_base_level`` on the first trading day.
+    With ``incremental=True`` each index resumes from its last stored
+    ``index_performance`` row before ``start_date`` (or its latest stored row
+    when ``start_date`` is omitted), chaining the level from that checkpoint
+    and only writing the newly computed dates. ``end_date`` then defaults to
+    the latest available market-cap date.
+
+    The result has one entry per index under ``indexes``; the top-level
+    fields summarize them (earliest start, most days processed) and match the
+    single index's when only one is built. ``progress`` is told the trading
+    days processed so far out of the total over all indexes: per day with
+    the loop engine, per stored index with the others.
+    """
+    return run_build(build_request(start_date, end_date, engine, incremental, index_ids), progress)
+
+
+def run_build(request: BuildRequest, progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Run a request from ``build_request``; see ``build_index``."""
+    definitions = index_definitions()
+    # builds hold the pool's single writer for their whole run, so they never interleave
+    with pool.writer() as conn:
+        return _build_index(
+            conn, request.start_date, request.end_date, request.engine, request.incremental,
+            [definitions[i] for i in request.index_ids], progress,
+        )
+
 
-    conn.close()
+def _count_trading_days(conn, start_date_str: str, end_date_str: str) -> int:
+    return query(
+        conn,
+        "SELECT COUNT(DISTINCT date) FROM daily_market_caps WHERE date BETWEEN ? AND ?",
+        (start_date_str, end_date_str),
+        mode="tuple",
+    )[0][0]
+
+
+def _build_index(conn, start_date_str: Optional[str],
+                 end_date: Optional[Union[str, dt.date]],
+                 engine: str, incremental: bool,
+                 definitions: List[IndexDefinition],
+                 progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Any]] = {}
+    checkpoints: Dict[str, IndexCheckpoint] = {}
+    start_dates: Dict[str, str] = {}
+    for definition in definitions:
+        index_id = definition.index_id
+        checkpoint = _load_checkpoint(conn, index_id, start_date_str) if incremental else None
+        if checkpoint is not None:
+            checkpoints[index_id] = checkpoint
+        if start_date_str is not None:
+            start_dates[index_id] = start_date_str
+        elif checkpoint is not None:
+            start_dates[index_id] = (safe_parse_date(checkpoint.date) + dt.timedelta(days=1)).isoformat()
+        else:
+            results[index_id] = {"status": "error", "message": "No stored index to continue from"}
 
+    end_date_str = _normalize_date(end_date)
+    if end_date_str is None:
+        if incremental:
+            latest = query(conn, "SELECT MAX(date) AS date FROM daily_market_caps")
+            end_date_str = _normalize_date(latest[0]["date"])
+        end_date_str = end_date_str or start_date_str or min(start_dates.values(), default=None)
+
+    pending = [d for d in definitions if d.index_id in start_dates]
+    days_total = sum(_count_trading_days(conn, start_dates[d.index_id], end_date_str) for d in pending)
+    days_done = 0
+
+    def advance(days: int) -> None:
+        nonlocal days_done
+        days_done += days
+        if progress:
+            progress(days_done, days_total)
+
+    advance(0)
+    if engine != "loop":
+        workers = (settings.build_workers or os.cpu_count() or 1) if engine == "parallel" else 1
+        built = compute_indexes_vectorized(
+            conn, pending, start_dates, end_date_str, settings.index_base_level,
+            checkpoints=checkpoints, store=open_store(conn), workers=workers, on_days=advance,
+        )
+    else:
+        built = {
+            d.index_id: _compute_index_loop(
+                conn, start_dates[d.index_id], end_date_str,
+                checkpoint=checkpoints.get(d.index_id), top_n=d.top_n,
+                on_day=lambda: advance(1),
+            )
+            for d in pending
+        }
+
+    stored = False
+    for definition in pending:
+        index_id = definition.index_id
+        checkpoint = checkpoints.get(index_id)
+        trading_dates, compositions, perf_rows = built[index_id]
+        result = {
+            "status": "success",
+            "start": start_dates[index_id],
+            "end": end_date_str,
+            "engine": engine,
+            "resumed_from": checkpoint.date if checkpoint else None,
+            "days_processed": len(trading_dates),
+        }
+        if trading_dates:
+            _store_build(conn, index_id, compositions, perf_rows, checkpoint)
+            stored = True
+            result["message"] = "Index built and stored"
+        elif checkpoint is not None:
+            result["message"] = "Index already up to date"
+        else:
+            result = {"status": "error", "message": "No trading days in range"}
+        results[index_id] = result
+    if stored:
+        cache.invalidate()
+    return _summarize_builds({d.index_id: results[d.index_id] for d in definitions}, engine)
+
+
+def _summarize_builds(results: Dict[str, Dict[str, Any]], engine: str) -> Dict[str, Any]:
+    """Top-level build result: the single index's own result, or a summary of several."""
+    ordered = results
+    if len(ordered) == 1:
+        (result,) = ordered.values()
+        return {**result, "indexes": ordered}
+    succeeded = [r for r in ordered.values() if r["status"] == "success"]
+    if not succeeded:
+        return {"status": "error", "message": "No index was built", "indexes": ordered}
+    resumed = [r["resumed_from"] for r in succeeded if r["resumed_from"]]
+    built = any(r["message"] == "Index built and stored" for r in succeeded)
     return {
         "status": "success",
-        "start": start_date_str,
-        "end": end_date_str,
-        "days_processed": len(trading_dates),
-        "message": "Index built and stored"
+        "start": min(r["start"] for r in succeeded),
+        "end": succeeded[0]["end"],
+        "engine": engine,
+        "resumed_from": min(resumed) if resumed else None,
+        "days_processed": max(r["days_processed"] for r in succeeded),
+        "message": "Indexes built and stored" if built else "Indexes already up to date",
+        "indexes": ordered,
     }
 
 
 def get_index_performance(start_date: Union[str, dt.date],
-                          end_date: Optional[Union[str, dt.date]] = None) -> List[Dict[str, Any]]:
+                          end_date: Optional[Union[str, dt.date]] = None,
+                          index_id: str = DEFAULT_INDEX_ID) -> List[Dict[str, Any]]:
     start_date_str = _normalize_date(start_date)
     end_date_str = _normalize_date(end_date) or start_date_str
 
-    conn = get_connection()
-    rows = query(
+    with pool.reader() as conn:
+        return query(
+            conn,
+            """
+            SELECT date, daily_return, cumulative_return, index_level
+            FROM index_performance
+            WHERE index_id = ? AND date BETWEEN ? AND ?
+            ORDER BY date
+            """,
+            (index_id, start_date_str, end_date_str),
+        )
+
+
+def get_index_analytics(start_date: Union[str, dt.date],
+                        end_date: Optional[Union[str, dt.date]] = None,
+                        index_id: str = DEFAULT_INDEX_ID) -> List[Dict[str, Any]]:
+    start_date_str = _normalize_date(start_date)
+    end_date_str = _normalize_date(end_date) or start_date_str
+
+    with pool.reader() as conn:
+        return query(
+            conn,
+            """
+            SELECT date, volatility, peak_level, drawdown, turnover
+            FROM index_analytics
+            WHERE index_id = ? AND date BETWEEN ? AND ?
+            ORDER BY date
+            """,
+            (index_id, start_date_str, end_date_str),
+        )
+
+
+def performance_months(start_date_str: str, end_date_str: str) -> Optional[List[str]]:
+    """Calendar months (``YYYY-MM``) spanned by a range, or None if a bound is not an ISO date."""
+    try:
+        start = dt.date.fromisoformat(start_date_str)
+        end = dt.date.fromisoformat(end_date_str)
+    except (TypeError, ValueError):
+        return None
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def get_index_performance_months(months: List[str],
+                                 index_id: str = DEFAULT_INDEX_ID) -> Dict[str, List[Dict[str, Any]]]:
+    """Load whole calendar months of index performance with one ranged query.
+
+    Every requested month gets an entry, empty if it has no rows, so callers
+    can cache the result per month.
+    """
+    by_month: Dict[str, List[Dict[str, Any]]] = {month: [] for month in months}
+    if not months:
+        return by_month
+    with pool.reader() as conn:
+        rows = query(
+            conn,
+            """
+            SELECT date, daily_return, cumulative_return, index_level
+            FROM index_performance
+            WHERE index_id = ? AND date BETWEEN ? AND ?
+            ORDER BY date
+            """,
+            (index_id, f"{min(months)}-01", f"{max(months)}-31"),
+        )
+    for row in rows:
+        bucket = by_month.get(row["date"][:7])
+        if bucket is not None:
+            bucket.append(row)
+    return by_month
+
+
+def _composition_on(conn, index_id: str, date_str: str, mode: str = "dict"):
+    return query(
         conn,
         """
-        SELECT *
-        FROM index_performance
-        WHERE date BETWEEN ? AND ?
-        ORDER BY date
+        SELECT s.symbol, c.weight
+        FROM index_compositions c
+        JOIN stocks s ON s.symbol_id = c.symbol_id
+        WHERE c.index_id = ? AND c.date = ?
+        ORDER BY s.symbol
         """,
-        (start_date_str, end_date_str),
+        (index_id, date_str),
+        mode=mode,
     )
-    conn.close()
-    return rows
 
 
-def get_index_composition(date: Union[str, dt.date]) -> List[Dict[str, Any]]:
+def get_index_composition(date: Union[str, dt.date],
+                          index_id: str = DEFAULT_INDEX_ID) -> List[Dict[str, Any]]:
     date_str = _normalize_date(date)
-    conn = get_connection()
-    rows = query(
+    with pool.reader() as conn:
+        return _composition_on(conn, index_id, date_str)
+
+
+COMPOSITION_RANGE_FORMATS = ("delta", "columnar")
+
+
+def get_composition_range(start_date: Union[str, dt.date],
+                          end_date: Union[str, dt.date],
+                          format: str = "delta",
+                          index_id: str = DEFAULT_INDEX_ID) -> Dict[str, Any]:
+    """Compositions for every stored date in a range as a base snapshot plus daily deltas.
+
+    ``dates`` lists the stored dates. ``base`` holds the tickers on the first
+    date, and every later date's members are the previous day's minus its
+    exits plus its entries, taken from ``index_composition_changes``.
+    ``"delta"`` gives ``changes`` in the shape ``get_composition_changes``
+    returns. ``"columnar"`` swaps tickers for indexes into a sorted
+    ``symbols`` list and flattens the changes into parallel ``change_day``
+    (index into ``dates``), ``change_symbol`` and ``change_entered`` arrays.
+
+    For an equal-weighted index ``weights`` holds each date's member weight.
+    Other indexes instead get ``base_weights``, aligned with ``base``, and
+    the weights that differ from the previous date (always including
+    entrants): ``weight_changes`` as ``{"date", "weights": {ticker: weight}}``
+    entries for ``"delta"``, or parallel ``weight_day``, ``weight_symbol``
+    and ``weight_value`` arrays for ``"columnar"``.
+    """
+    start_date_str = _normalize_date(start_date)
+    end_date_str = _normalize_date(end_date) or start_date_str
+    if format not in COMPOSITION_RANGE_FORMATS:
+        raise ValueError(f"Unsupported composition range format: {format}")
+    definition = index_definitions().get(index_id)
+    if definition is None:
+        raise ValueError(f"Unknown index id: {index_id}")
+
+    with pool.reader() as conn:
+        days = query(
+            conn,
+            """
+            SELECT date, MAX(weight) AS weight
+            FROM index_compositions
+            WHERE index_id = ? AND date BETWEEN ? AND ?
+            GROUP BY date
+            ORDER BY date
+            """,
+            (index_id, start_date_str, end_date_str),
+            mode="columns",
+        )
+        first = _composition_on(conn, index_id, days["date"][0], mode="columns") if days["date"] else None
+        base = first["symbol"] if first else []
+        moves = list(_composition_changes_table_cursor(conn, index_id, start_date_str, end_date_str))
+        weight_moves = None
+        if not definition.equal_weighted:
+            weight_moves = _weight_changes(conn, index_id, start_date_str, end_date_str)
+
+    if weight_moves is None:
+        weights = {"weights": days["weight"]}
+    else:
+        weights = {"base_weights": first["weight"] if first else []}
+
+    if format == "delta":
+        payload = {"dates": days["date"], **weights, "base": base,
+                   "changes": list(_iter_grouped_changes(moves))}
+        if weight_moves is not None:
+            payload["weight_changes"] = [
+                {"date": d, "weights": {symbol: weight for _, symbol, weight in rows}}
+                for d, rows in groupby(weight_moves, key=itemgetter(0))
+            ]
+        return payload
+
+    symbols = sorted(set(base).union(symbol for _, _, symbol in moves))
+    codes = {symbol: i for i, symbol in enumerate(symbols)}
+    day_index = {d: i for i, d in enumerate(days["date"])}
+    payload = {
+        "dates": days["date"],
+        **weights,
+        "symbols": symbols,
+        "base": [codes[symbol] for symbol in base],
+        "change_day": [day_index[_normalize_date(d)] for d, _, _ in moves],
+        "change_symbol": [codes[symbol] for _, _, symbol in moves],
+        "change_entered": [action == "entered" for _, action, _ in moves],
+    }
+    if weight_moves is not None:
+        payload["weight_day"] = [day_index[d] for d, _, _ in weight_moves]
+        payload["weight_symbol"] = [codes[symbol] for _, symbol, _ in weight_moves]
+        payload["weight_value"] = [weight for _, _, weight in weight_moves]
+    return payload
+
+
+def _weight_changes(conn, index_id: str, start_date_str: str, end_date_str: str) -> List[tuple]:
+    """``(date, ticker, weight)`` for every member whose weight differs from the
+    previous stored date in the range, after the first date."""
+    rows = iter_query(
         conn,
         """
-        SELECT symbol, weight
-        FROM index_compositions
-        WHERE date = ?
-        ORDER BY symbol
+        SELECT c.date, s.symbol, c.weight
+        FROM index_compositions c
+        JOIN stocks s ON s.symbol_id = c.symbol_id
+        WHERE c.index_id = ? AND c.date BETWEEN ? AND ?
+        ORDER BY c.date, s.symbol
         """,
-        (date_str,),
+        (index_id, start_date_str, end_date_str),
+        mode="tuple",
     )
-    conn.close()
-    return rows
+    changes: List[tuple] = []
+    previous: Optional[Dict[str, float]] = None
+    for d, group in groupby(rows, key=itemgetter(0)):
+        current = {symbol: weight for _, symbol, weight in group}
+        if previous is not None:
+            d = _normalize_date(d)
+            changes.extend((d, symbol, weight) for symbol, weight in current.items()
+                           if previous.get(symbol) != weight)
+        previous = current
+    return changes
 
 
-def get_composition_changes(start_date: Union[str, dt.date],
-                            end_date: Union[str, dt.date]) -> List[Dict[str, Any]]:
-    start_date_str = _normalize_date(start_date)
-    end_date_str = _normalize_date(end_date)
+COMPOSITION_CHANGES_METHODS = ("loop", "sql", "table")
+
+# Entered/exited symbols of one index for every stored date in a range, each
+# date compared with the previous stored date via LAG and anti-joins between
+# the snapshots. Takes named :index_id, :start and :end parameters.
+_COMPOSITION_MOVES_SQL = """
+    WITH days AS (
+        SELECT date, LAG(date) OVER (ORDER BY date) AS prev_date
+        FROM (
+            SELECT DISTINCT date
+            FROM index_compositions
+            WHERE index_id = :index_id AND date BETWEEN :start AND :end
+        )
+    ),
+    moves AS (
+        SELECT d.date, c.symbol_id, 'entered' AS action
+        FROM days d
+        JOIN index_compositions c ON c.index_id = :index_id AND c.date = d.date
+        WHERE d.prev_date IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM index_compositions p
+              WHERE p.index_id = :index_id AND p.date = d.prev_date AND p.symbol_id = c.symbol_id
+          )
+        UNION ALL
+        SELECT d.date, p.symbol_id, 'exited' AS action
+        FROM days d
+        JOIN index_compositions p ON p.index_id = :index_id AND p.date = d.prev_date
+        WHERE NOT EXISTS (
+            SELECT 1 FROM index_compositions c
+            WHERE c.index_id = :index_id AND c.date = d.date AND c.symbol_id = p.symbol_id
+        )
+    )
+"""
+
 
-    conn = get_connection()
-    dates_rows = query(
+def _iter_grouped_changes(cur: Iterable[tuple]) -> Iterator[Dict[str, Any]]:
+    """Group ``(date, action, symbol)`` rows ordered by date into change dicts."""
+    for d, rows in groupby(cur, key=itemgetter(0)):
+        change = {"date": _normalize_date(d), "entered": [], "exited": []}
+        for _, action, symbol in rows:
+            change[action].append(symbol)
+        yield change
+
+
+def _composition_changes_loop(conn, index_id: str, start_date_str: str,
+                              end_date_str: str) -> List[Dict[str, Any]]:
+    dates = query(
         conn,
         """
         SELECT DISTINCT date
         FROM index_compositions
-        WHERE date BETWEEN ? AND ?
+        WHERE index_id = ? AND date BETWEEN ? AND ?
         ORDER BY date
         """,
-        (start_date_str, end_date_str),
-    )
-    dates = [r["date"] for r in dates_rows]
+        (index_id, start_date_str, end_date_str),
+        mode="columns",
+    )["date"]
+    names = symbol_names(conn)
 
     changes: List[Dict[str, Any]] = []
-    prev_symbols: Optional[set] = None
+    prev_symbols: Optional[FrozenSet[int]] = None
 
     for d in dates:
-        rows = query(
+        rows = iter_query(
             conn,
-            "SELECT symbol FROM index_compositions WHERE date = ? ORDER BY symbol",
-            (d,),
+            "SELECT symbol_id FROM index_compositions WHERE index_id = ? AND date = ?",
+            (index_id, d),
+            mode="tuple",
         )
-        symbols = {r["symbol"] for r in rows}
+        symbols = frozenset(sid for (sid,) in rows)
 
         if prev_symbols is not None:
-            entered = sorted(list(symbols - prev_symbols))
-            exited = sorted(list(prev_symbols - symbols))
+            entered = sorted(names[i] for i in symbols - prev_symbols)
+            exited = sorted(names[i] for i in prev_symbols - symbols)
             if entered or exited:
                 changes.append({
                     "date": d,
@@ -211,5 +816,178 @@ def get_composition_changes(start_date: Union[str, dt.date],
 
         prev_symbols = symbols
 
-    conn.close()
     return changes
+
+
+def _composition_changes_sql(conn, index_id: str, start_date_str: str,
+                             end_date_str: str) -> List[Dict[str, Any]]:
+    """Entries and exits for every trading day in one statement, grouped as rows stream back."""
+    cur = conn.execute(
+        _COMPOSITION_MOVES_SQL + """
+        SELECT m.date, m.action, s.symbol
+        FROM moves m
+        JOIN stocks s ON s.symbol_id = m.symbol_id
+        ORDER BY m.date, m.action, s.symbol
+        """,
+        {"index_id": index_id, "start": start_date_str, "end": end_date_str},
+    )
+    return list(_iter_grouped_changes(cur))
+
+
+def _composition_changes_table_cursor(conn, index_id: str, start_date_str: str, end_date_str: str):
+    """Indexed range read of the changes persisted by ``build_index``.
+
+    The first stored date in the range is excluded, matching the other methods,
+    which only compare dates inside the range.
+    """
+    return conn.execute(
+        """
+        SELECT ch.date, ch.action, s.symbol
+        FROM index_composition_changes ch
+        JOIN stocks s ON s.symbol_id = ch.symbol_id
+        WHERE ch.index_id = :index_id
+          AND ch.date > (
+            SELECT MIN(date) FROM index_compositions
+            WHERE index_id = :index_id AND date BETWEEN :start AND :end
+          )
+          AND ch.date <= :end
+        ORDER BY ch.date, ch.action, s.symbol
+        """,
+        {"index_id": index_id, "start": start_date_str, "end": end_date_str},
+    )
+
+
+def _composition_changes_table(conn, index_id: str, start_date_str: str,
+                               end_date_str: str) -> List[Dict[str, Any]]:
+    cur = _composition_changes_table_cursor(conn, index_id, start_date_str, end_date_str)
+    return list(_iter_grouped_changes(cur))
+
+
+def backfill_composition_changes() -> int:
+    """Populate index_composition_changes from stored compositions if it is empty.
+
+    Databases built before the table existed get every index's history
+    derived once; afterwards ``build_index`` keeps it up to date. Returns the
+    rows written.
+    """
+    with pool.writer() as conn:
+        has_changes = query(conn, "SELECT 1 FROM index_composition_changes LIMIT 1")
+        if has_changes:
+            return 0
+        index_ids = query(conn, "SELECT DISTINCT index_id FROM index_compositions", mode="columns")["index_id"]
+        before = conn.total_changes
+        with conn:
+            for index_id in index_ids:
+                conn.execute(
+                    _COMPOSITION_MOVES_SQL + """
+                    INSERT INTO index_composition_changes(index_id, date, symbol_id, action)
+                    SELECT :index_id, date, symbol_id, action FROM moves
+                    """,
+                    {"index_id": index_id, "start": "0001-01-01", "end": "9999-12-31"},
+                )
+        return conn.total_changes - before
+
+
+def backfill_index_analytics() -> int:
+    """Populate index_analytics from stored performance and compositions if it is empty.
+
+    Like ``backfill_composition_changes``, this derives the history once for
+    databases built before the table existed. Returns the rows written.
+    """
+    with pool.writer() as conn:
+        if query(conn, "SELECT 1 FROM index_analytics LIMIT 1"):
+            return 0
+        index_ids = query(conn, "SELECT DISTINCT index_id FROM index_performance", mode="columns")["index_id"]
+        before = conn.total_changes
+        with conn:
+            for index_id in index_ids:
+                compositions = iter_query(
+                    conn,
+                    "SELECT date, symbol_id, weight FROM index_compositions WHERE index_id = ? ORDER BY date",
+                    (index_id,),
+                    mode="tuple",
+                )
+                _store_analytics(conn, index_id, "0001-01-01", compositions, None, None)
+        return conn.total_changes - before
+
+
+def get_composition_changes(start_date: Union[str, dt.date],
+                            end_date: Union[str, dt.date],
+                            method: Optional[str] = None,
+                            index_id: str = DEFAULT_INDEX_ID) -> List[Dict[str, Any]]:
+    start_date_str = _normalize_date(start_date)
+    end_date_str = _normalize_date(end_date)
+    method = method or settings.composition_changes_method
+    if method not in COMPOSITION_CHANGES_METHODS:
+        raise ValueError(f"Unsupported composition changes method: {method}")
+
+    with pool.reader() as conn:
+        if method == "table":
+            return _composition_changes_table(conn, index_id, start_date_str, end_date_str)
+        if method == "sql":
+            return _composition_changes_sql(conn, index_id, start_date_str, end_date_str)
+        return _composition_changes_loop(conn, index_id, start_date_str, end_date_str)
+
+
+EXPORT_DATASETS = ("performance", "composition", "changes")
+
+EXPORT_COLUMNS = {
+    "performance": ["date", "daily_return", "cumulative_return", "index_level"],
+    "composition": ["date", "symbol", "weight"],
+    "changes": ["date", "entered", "exited"],
+}
+
+
+def _iter_export_rows(conn, dataset: str, index_id: str,
+                      start_date_str: str, end_date_str: str) -> Iterator[tuple]:
+    if dataset == "performance":
+        cur = conn.execute(
+            """
+            SELECT date, daily_return, cumulative_return, index_level
+            FROM index_performance
+            WHERE index_id = ? AND date BETWEEN ? AND ?
+            ORDER BY date
+            """,
+            (index_id, start_date_str, end_date_str),
+        )
+        return ((_normalize_date(d), *rest) for d, *rest in cur)
+    if dataset == "composition":
+        cur = conn.execute(
+            """
+            SELECT c.date, s.symbol, c.weight
+            FROM index_compositions c
+            JOIN stocks s ON s.symbol_id = c.symbol_id
+            WHERE c.index_id = ? AND c.date BETWEEN ? AND ?
+            ORDER BY c.date, s.symbol
+            """,
+            (index_id, start_date_str, end_date_str),
+        )
+        return ((_normalize_date(d), *rest) for d, *rest in cur)
+    cur = _composition_changes_table_cursor(conn, index_id, start_date_str, end_date_str)
+    return ((c["date"], c["entered"], c["exited"]) for c in _iter_grouped_changes(cur))
+
+
+def iter_export_datasets(datasets: Iterable[str],
+                         start_date: Union[str, dt.date],
+                         end_date: Optional[Union[str, dt.date]] = None,
+                         index_id: str = DEFAULT_INDEX_ID,
+                         ) -> Iterator[Tuple[str, List[str], Iterator[tuple]]]:
+    """Yield ``(dataset, columns, rows)`` for each requested dataset.
+
+    Rows come straight off one ranged cursor per dataset, so a consumer that
+    writes each dataset out before asking for the next keeps memory flat
+    regardless of the range length. A streaming response may advance this from
+    several worker threads, so it uses its own connection, not a pooled one.
+    """
+    start_date_str = _normalize_date(start_date)
+    end_date_str = _normalize_date(end_date) or start_date_str
+    conn = get_connection(check_same_thread=False, read_only=True)
+    try:
+        for dataset in datasets:
+            if dataset not in EXPORT_DATASETS:
+                raise ValueError(f"Unsupported export dataset: {dataset}")
+            yield dataset, EXPORT_COLUMNS[dataset], _iter_export_rows(
+                conn, dataset, index_id, start_date_str, end_date_str
+            )
+    finally:
+        conn.close()
@@ -0,0 +1,457 @@
+from __future__ import annotations
+
+import multiprocessing
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import groupby
+from typing import Callable, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..columnar_store import ColumnarStore
+from .index_definitions import IndexDefinition
+
+
+class IndexCheckpoint(NamedTuple):
+    """Last stored index state that an incremental build continues from."""
+
+    date: str
+    index_level: float
+    symbols: FrozenSet[int]
+
+
+class MarketMatrices(NamedTuple):
+    """Market caps and adjusted closes over a date range as date x symbol matrices."""
+
+    dates: np.ndarray       # ISO date strings, ascending
+    symbol_ids: np.ndarray  # ascending
+    market_cap: np.ndarray  # NaN where a symbol has no market cap that day
+    adj_close: np.ndarray   # aligned to market_cap
+
+
+class VariantArrays(NamedTuple):
+    """One index's daily returns and member weights over a run of days, before levels are chained."""
+
+    daily_returns: np.ndarray
+    day_idx: np.ndarray  # row of each member entry
+    sym_idx: np.ndarray  # symbol column of each member entry
+    weights: np.ndarray  # weight of each member entry
+
+
+# (trading_dates, compositions, perf_rows) for one index, as the loop engine returns them
+BuildResult = Tuple[List[str], List[tuple], List[tuple]]
+
+# Days are computed in blocks of at least this many, so a build reports
+# progress as it goes and short ranges are not split any further.
+MIN_CHUNK_DAYS = 63
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+def _build_pool(workers: int) -> ProcessPoolExecutor:
+    """The shared process pool for parallel builds, resized if ``workers`` changed."""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is not None and _process_pool_workers != workers:
+            _process_pool.shutdown(wait=True)
+            _process_pool = None
+        if _process_pool is None:
+            # spawn, not fork: the API process has threads holding locks and connections
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _process_pool_workers = workers
+        return _process_pool
+
+
+def shutdown_build_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=True)
+            _process_pool = None
+
+
+def _load_matrix(conn: sqlite3.Connection, table: str, value: str,
+                 params: Tuple[str, str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Read one column of a date-ranged table into ``(dates, symbol_ids, matrix)``.
+
+    Rows come back as plain tuples of numbers in date order, flattened
+    straight into one float array, and the dates are read once per day with
+    their row counts; no per-row date strings or type converters are
+    involved. Missing values are left out and become NaN in the matrix.
+    """
+    days = conn.execute(
+        f"""
+        SELECT CAST(date AS TEXT), COUNT(*)
+        FROM {table}
+        WHERE date BETWEEN ? AND ? AND {value} IS NOT NULL
+        GROUP BY date
+        ORDER BY date
+        """,
+        params,
+    ).fetchall()
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(
+        f"""
+        SELECT symbol_id, {value}
+        FROM {table}
+        WHERE date BETWEEN ? AND ? AND {value} IS NOT NULL
+        ORDER BY date
+        """,
+        params,
+    )
+    flat = np.fromiter((x for row in cur for x in row), dtype=float)
+    dates = np.array([d for d, _ in days], dtype=str)
+    day_idx = np.repeat(np.arange(len(days)), [n for _, n in days])
+    symbol_ids, sym_idx = np.unique(flat[0::2].astype(np.int64), return_inverse=True)
+    matrix = np.full((len(dates), len(symbol_ids)), np.nan)
+    matrix[day_idx, sym_idx] = flat[1::2]
+    return dates, symbol_ids, matrix
+
+
+def _load_from_sql(conn: sqlite3.Connection, start_date_str: str,
+                   end_date_str: str) -> Optional[MarketMatrices]:
+    # one read transaction, so an ingest cannot land between the queries
+    conn.execute("BEGIN")
+    try:
+        dates, symbol_ids, mcaps = _load_matrix(
+            conn, "daily_market_caps", "market_cap", (start_date_str, end_date_str)
+        )
+        if not len(dates):
+            return None
+        price_dates, price_ids, prices = _load_matrix(
+            conn, "daily_prices", "adj_close", (start_date_str, end_date_str)
+        )
+    finally:
+        conn.rollback()
+    # align prices to the market cap grid; days or symbols without a cap are dropped
+    adj_close = np.full_like(mcaps, np.nan)
+    rows = np.searchsorted(dates, price_dates).clip(max=len(dates) - 1)
+    cols = np.searchsorted(symbol_ids, price_ids).clip(max=len(symbol_ids) - 1)
+    row_ok, col_ok = dates[rows] == price_dates, symbol_ids[cols] == price_ids
+    adj_close[np.ix_(rows[row_ok], cols[col_ok])] = prices[np.ix_(row_ok, col_ok)]
+    return MarketMatrices(dates, symbol_ids, mcaps, adj_close)
+
+
+def _load_from_store(store: ColumnarStore, start_date_str: str,
+                     end_date_str: str) -> Optional[MarketMatrices]:
+    """Slice the date range out of the mapped store as views, without copying.
+
+    The store holds every symbol, not only those with caps in the range, but
+    symbols without a cap are never ranked in, so the results are the same.
+    """
+    lo = int(np.searchsorted(store.dates, start_date_str, side="left"))
+    hi = int(np.searchsorted(store.dates, end_date_str, side="right"))
+    if lo >= hi:
+        return None
+    return MarketMatrices(
+        store.dates[lo:hi], store.symbol_ids, store.market_cap[lo:hi], store.adj_close[lo:hi]
+    )
+
+
+def _select_rows(matrices: MarketMatrices, start_date_str: str,
+                 seed_date: Optional[str]) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+    """Trading dates, caps and prices from ``start_date_str`` on, led by ``seed_date`` if given.
+
+    A seed day that is not in ``matrices`` becomes a row of NaNs. Without a
+    seed, or with the seed right before the start, the matrices are views.
+    """
+    dates = matrices.dates
+    lo = int(np.searchsorted(dates, start_date_str, side="left"))
+    if lo >= len(dates):
+        return None
+    caps, px = matrices.market_cap[lo:], matrices.adj_close[lo:]
+    trading_dates = dates[lo:].tolist()
+    if seed_date is not None:
+        seed = int(np.searchsorted(dates, seed_date))
+        stored = seed < len(dates) and dates[seed] == seed_date
+        if stored and seed == lo - 1:
+            caps, px = matrices.market_cap[seed:], matrices.adj_close[seed:]
+        else:
+            if stored:
+                seed_caps, seed_px = matrices.market_cap[seed], matrices.adj_close[seed]
+            else:
+                seed_caps = seed_px = np.full(len(matrices.symbol_ids), np.nan)
+            caps = np.vstack([seed_caps, caps])
+            px = np.vstack([seed_px, px])
+        trading_dates = [seed_date, *trading_dates]
+    return trading_dates, caps, px
+
+
+def _sector_codes(conn: sqlite3.Connection, symbol_ids: np.ndarray) -> np.ndarray:
+    """Integer sector code per symbol; symbols without a sector share one code."""
+    sector_by_id = dict(conn.execute("SELECT symbol_id, sector FROM stocks"))
+    _, codes = np.unique([str(sector_by_id.get(int(sid))) for sid in symbol_ids], return_inverse=True)
+    return codes
+
+
+def _cap_sectors(weights: np.ndarray, sectors: np.ndarray, cap: float) -> np.ndarray:
+    """Scale each day's weights so that no sector's total exceeds ``cap``.
+
+    Sectors over the cap are scaled down to it and the excess is spread over
+    the remaining sectors in proportion to their weight, repeating until no
+    sector is over (at most once per sector). Days with too few sectors to
+    stay under the cap end with every sector at an equal share.
+    """
+    onehot = np.zeros((len(sectors), int(sectors.max()) + 1))
+    onehot[np.arange(len(sectors)), sectors] = 1.0
+    capped = np.zeros((weights.shape[0], onehot.shape[1]), dtype=bool)
+    for _ in range(onehot.shape[1]):
+        totals = weights @ onehot
+        over = totals > cap * (1 + 1e-12)
+        if not over.any():
+            break
+        capped |= over
+        free = np.where(capped, 0.0, totals).sum(axis=1, keepdims=True)
+        room = 1.0 - cap * capped.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(capped, cap / totals, room / free)
+        scale = np.where(np.isfinite(scale) & (scale >= 0), scale, 1.0)
+        # days already under the cap stay as they are, so each day's result
+        # does not depend on which other days are scaled alongside it
+        scale[~over.any(axis=1)] = 1.0
+        weights = weights * (scale @ onehot.T)
+    totals = weights.sum(axis=1, keepdims=True)
+    return np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+
+def _weights(definition: IndexDefinition, caps: np.ndarray, members: np.ndarray,
+             sectors: Optional[np.ndarray]) -> np.ndarray:
+    """Date x symbol weights of the members under a definition's weighting and sector cap."""
+    if definition.weighting == "cap":
+        member_caps = np.where(members & ~np.isnan(caps), caps, 0.0)
+    else:
+        member_caps = members.astype(float)
+    totals = member_caps.sum(axis=1, keepdims=True)
+    weights = np.divide(member_caps, totals, out=np.zeros_like(member_caps), where=totals > 0)
+    if definition.sector_cap is not None:
+        weights = _cap_sectors(weights, sectors, definition.sector_cap)
+    return weights
+
+
+def _variant_arrays(definition: IndexDefinition, caps: np.ndarray, px: np.ndarray,
+                    has_cap: np.ndarray, order: np.ndarray, sectors: Optional[np.ndarray],
+                    lead_members: Optional[np.ndarray], has_lead: bool) -> VariantArrays:
+    """Members, weights and daily returns of one definition over a block of days.
+
+    With ``has_lead`` the first row is only there to give the next day's
+    return its previous day, and is dropped from the result; its membership
+    is ``lead_members`` when given (a checkpoint's stored snapshot) and the
+    day's own top N otherwise.
+    """
+    # Keep each day's top N of the shared ranking.
+    order = order[:, :definition.top_n]
+    selected = np.take_along_axis(has_cap, order, axis=1)
+    counts = selected.sum(axis=1)
+
+    members = np.zeros_like(has_cap)
+    day_idx, rank_idx = np.nonzero(selected)
+    sym_idx = order[day_idx, rank_idx]
+    members[day_idx, sym_idx] = True
+    if lead_members is not None:
+        members[0] = lead_members
+    weights = None if definition.equal_weighted else _weights(definition, caps, members, sectors)
+
+    # Constituent returns for symbols held on both consecutive days with usable prices.
+    daily_returns = np.zeros(len(caps))
+    if len(caps) > 1:
+        prev_px, curr_px = px[:-1], px[1:]
+        valid = (
+            members[:-1] & members[1:]
+            & ~np.isnan(prev_px) & ~np.isnan(curr_px)
+            & (prev_px != 0) & (curr_px != 0)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rets = np.where(valid, curr_px / prev_px - 1.0, 0.0)
+        if weights is None:
+            n_valid = valid.sum(axis=1)
+            daily_returns[1:] = np.divide(
+                rets.sum(axis=1), n_valid,
+                out=np.zeros(len(n_valid)), where=n_valid > 0,
+            )
+        else:
+            # previous day's weights, renormalized over the constituents with usable prices
+            held = np.where(valid, weights[:-1], 0.0)
+            total = held.sum(axis=1)
+            daily_returns[1:] = np.divide(
+                (held * rets).sum(axis=1), total,
+                out=np.zeros(len(total)), where=total > 0,
+            )
+
+    member_weights = 1.0 / counts[day_idx] if weights is None else weights[day_idx, sym_idx]
+    if has_lead:
+        daily_returns = daily_returns[1:]
+        keep = day_idx > 0
+        day_idx, sym_idx, member_weights = day_idx[keep] - 1, sym_idx[keep], member_weights[keep]
+    return VariantArrays(daily_returns, day_idx, sym_idx, member_weights)
+
+
+def _compute_chunk(definitions: Sequence[IndexDefinition], caps: np.ndarray, px: np.ndarray,
+                   sectors: Optional[np.ndarray], lead_members: Dict[str, np.ndarray],
+                   has_lead: bool) -> Dict[str, VariantArrays]:
+    """Rank a block of days by market cap once and derive every definition from it.
+
+    Runs in the build process or, for parallel builds, in a pool worker.
+    """
+    # One memory layout however the block arrived, so row sums add up in the same order.
+    caps, px = np.ascontiguousarray(caps), np.ascontiguousarray(px)
+    # Rank every day by market cap (descending, missing caps last).
+    has_cap = ~np.isnan(caps)
+    order = np.argsort(np.where(has_cap, -caps, np.inf), axis=1, kind="stable")
+    order = order[:, :max(d.top_n for d in definitions)]
+    return {
+        d.index_id: _variant_arrays(
+            d, caps, px, has_cap, order, sectors, lead_members.get(d.index_id), has_lead
+        )
+        for d in definitions
+    }
+
+
+def _compute_chunks(definitions: Sequence[IndexDefinition], caps: np.ndarray, px: np.ndarray,
+                    sectors: Optional[np.ndarray], lead_members: Dict[str, np.ndarray],
+                    has_lead: bool, workers: int,
+                    on_days: Optional[Callable[[int], None]] = None) -> Dict[str, VariantArrays]:
+    """``_compute_chunk`` over consecutive blocks of days, in the process pool when ``workers`` is above 1.
+
+    Every block after the first also gets the day before it as a lead row,
+    so its first return is computed exactly as in a single block. As each
+    block finishes, ``on_days`` gets the number of index days it computed
+    over all definitions. The blocks' returns and member entries are
+    concatenated in date order.
+    """
+    n_chunks = max(1, len(caps) // MIN_CHUNK_DAYS)
+    bounds = np.linspace(0, len(caps), n_chunks + 1).astype(int).tolist()
+    blocks = [(caps[:bounds[1]], px[:bounds[1]], lead_members, has_lead)]
+    blocks += [(caps[lo - 1:hi], px[lo - 1:hi], {}, True) for lo, hi in zip(bounds[1:-1], bounds[2:])]
+
+    def computed(part: Dict[str, VariantArrays]) -> Dict[str, VariantArrays]:
+        if on_days:
+            on_days(sum(len(arrays.daily_returns) for arrays in part.values()))
+        return part
+
+    if workers > 1 and n_chunks > 1:
+        executor = _build_pool(workers)
+        futures = [executor.submit(_compute_chunk, definitions, block_caps, block_px, sectors, lead, lead_row)
+                   for block_caps, block_px, lead, lead_row in blocks]
+        for future in as_completed(futures):
+            computed(future.result())
+        parts = [f.result() for f in futures]
+    else:
+        parts = [computed(_compute_chunk(definitions, block_caps, block_px, sectors, lead, lead_row))
+                 for block_caps, block_px, lead, lead_row in blocks]
+    if len(parts) == 1:
+        return parts[0]
+
+    merged: Dict[str, VariantArrays] = {}
+    for definition in definitions:
+        chunks = [part[definition.index_id] for part in parts]
+        offsets = np.cumsum([0] + [len(c.daily_returns) for c in chunks[:-1]])
+        merged[definition.index_id] = VariantArrays(
+            np.concatenate([c.daily_returns for c in chunks]),
+            np.concatenate([c.day_idx + offset for c, offset in zip(chunks, offsets)]),
+            np.concatenate([c.sym_idx for c in chunks]),
+            np.concatenate([c.weights for c in chunks]),
+        )
+    return merged
+
+
+def _chain_levels(trading_dates: List[str], arrays: VariantArrays, symbol_ids: np.ndarray,
+                  start_level: float, base_level: float) -> BuildResult:
+    """Chain daily returns into levels from ``start_level`` and build the stored rows."""
+    # Chain from the start level in the same multiplication order as the loop engine.
+    index_levels = np.cumprod(np.concatenate(([start_level], 1.0 + arrays.daily_returns)))[1:]
+    cumulative_returns = index_levels / base_level - 1.0
+
+    dates_arr = np.asarray(trading_dates, dtype=object)
+    compositions = list(zip(
+        dates_arr[arrays.day_idx].tolist(),
+        symbol_ids[arrays.sym_idx].tolist(),
+        arrays.weights.tolist(),
+    ))
+    perf_rows = list(zip(
+        trading_dates,
+        arrays.daily_returns.tolist(),
+        cumulative_returns.tolist(),
+        index_levels.tolist(),
+    ))
+    return trading_dates, compositions, perf_rows
+
+
+def compute_indexes_vectorized(conn: sqlite3.Connection,
+                               definitions: Sequence[IndexDefinition],
+                               start_dates: Dict[str, str],
+                               end_date_str: str,
+                               base_level: float,
+                               checkpoints: Optional[Dict[str, IndexCheckpoint]] = None,
+                               store: Optional[ColumnarStore] = None,
+                               workers: int = 1,
+                               on_days: Optional[Callable[[int], None]] = None,
+                               ) -> Dict[str, BuildResult]:
+    """Compute compositions and performance for several index definitions in one pass.
+
+    Market caps and prices from the earliest start up to ``end_date_str`` are
+    loaded once, read as plain tuples into date x symbol matrices, or
+    sliced straight out of the memory-mapped ``store`` when one is given.
+    Definitions starting on the same day share one ranking by market cap;
+    each then takes its own top N, weights, constituent returns and chained
+    level with array operations. Returns ``{index_id: (trading_dates,
+    compositions, perf_rows)}`` in the shape the loop engine produces.
+
+    ``start_dates`` maps each index id to its first date. When an index has a
+    checkpoint, its date is loaded as a leading row whose membership is taken
+    from the stored snapshot, so the first new day's return and level chain
+    on from the stored state. Only rows after it are returned.
+
+    The days are split into consecutive blocks whose selections, weights and
+    returns are computed one after another or, with ``workers`` above 1, in a
+    process pool; only the cumulative product that chains levels runs over
+    the whole range. The results are identical however the days are split.
+    ``on_days`` is called with the index days each block adds, for progress.
+    """
+    checkpoints = checkpoints or {}
+    results: Dict[str, BuildResult] = {d.index_id: ([], [], []) for d in definitions}
+    if not definitions:
+        return results
+
+    def rows_key(definition: IndexDefinition) -> Tuple[str, str]:
+        checkpoint = checkpoints.get(definition.index_id)
+        return start_dates[definition.index_id], checkpoint.date if checkpoint else ""
+
+    # a checkpoint always lies before its index's start date
+    load_start = min(rows_key(d)[1] or rows_key(d)[0] for d in definitions)
+    if store is not None:
+        matrices = _load_from_store(store, load_start, end_date_str)
+    else:
+        matrices = _load_from_sql(conn, load_start, end_date_str)
+    if matrices is None:
+        return results
+    sectors = None
+    if any(d.sector_cap is not None for d in definitions):
+        sectors = _sector_codes(conn, matrices.symbol_ids)
+
+    for (start, seed_date), group in groupby(sorted(definitions, key=rows_key), key=rows_key):
+        group = list(group)
+        rows = _select_rows(matrices, start, seed_date or None)
+        if rows is None:
+            continue
+        trading_dates, caps, px = rows
+        lead_members = {
+            d.index_id: np.isin(matrices.symbol_ids, list(checkpoints[d.index_id].symbols))
+            for d in group if seed_date
+        }
+        arrays = _compute_chunks(group, caps, px, sectors, lead_members, bool(seed_date), workers, on_days)
+        if seed_date:
+            # the seed row is dropped; the stored level is the starting point of the chain
+            trading_dates = trading_dates[1:]
+        for definition in group:
+            checkpoint = checkpoints.get(definition.index_id)
+            results[definition.index_id] = _chain_levels(
+                trading_dates, arrays[definition.index_id], matrices.symbol_ids,
+                checkpoint.index_level if checkpoint else base_level, base_level,
+            )
+    return results
@@ -1,9 +1,31 @@
 from __future__ import annotations
 
+import csv
 import io
-from typing import Any, Dict, List
+import json
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 
 import pandas as pd
+import polars as pl
+import xlsxwriter
+
+# (dataset name, column names, row tuples) as produced by iter_export_datasets
+Dataset = Tuple[str, List[str], Iterable[tuple]]
+
+EXPORT_CHUNK_ROWS = 1000
+ARROW_BATCH_ROWS = 65_536
+
+ARROW_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "performance": {
+        "date": pl.Utf8,
+        "daily_return": pl.Float64,
+        "cumulative_return": pl.Float64,
+        "index_level": pl.Float64,
+    },
+    "composition": {"date": pl.Utf8, "symbol": pl.Utf8, "weight": pl.Float64},
+    "changes": {"date": pl.Utf8, "entered": pl.List(pl.Utf8), "exited": pl.List(pl.Utf8)},
+}
 
 
 def export_excel_bytes(
@@ -35,3 +57,85 @@ def export_excel_bytes(
     return buffer.getvalue()
 
 
+def _cell(value: Any) -> Any:
+    # normalize lists to comma-separated strings for Excel/CSV
+    return ", ".join(value) if isinstance(value, list) else value
+
+
+def write_excel_streaming(path: str, datasets: Iterable[Dataset]) -> None:
+    """Write one sheet per dataset to ``path`` row by row.
+
+    Uses xlsxwriter's ``constant_memory`` mode, which flushes each row to disk
+    as soon as the next one starts, so memory does not grow with the range.
+    Datasets without rows get no sheet, as in ``export_excel_bytes``.
+    """
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    header_format = workbook.add_format({"bold": True, "border": 1})
+    for name, columns, rows in datasets:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            continue
+        worksheet = workbook.add_worksheet(name.capitalize())
+        worksheet.write_row(0, 0, columns, header_format)
+        for i, row in enumerate(chain([first], rows), start=1):
+            worksheet.write_row(i, 0, [_cell(v) for v in row])
+    workbook.close()
+
+
+def iter_csv(datasets: Iterable[Dataset]) -> Iterator[bytes]:
+    """Encode datasets as CSV (header plus rows each), yielding chunks of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for _, columns, rows in datasets:
+        writer.writerow(columns)
+        for i, row in enumerate(rows, start=1):
+            writer.writerow([_cell(v) for v in row])
+            if i % EXPORT_CHUNK_ROWS == 0:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(datasets: Iterable[Dataset]) -> Iterator[bytes]:
+    """Encode datasets as newline-delimited JSON objects tagged with their dataset."""
+    lines: List[str] = []
+    for name, columns, rows in datasets:
+        for row in rows:
+            lines.append(json.dumps({"dataset": name, **dict(zip(columns, row))}))
+            if len(lines) >= EXPORT_CHUNK_ROWS:
+                yield ("\n".join(lines) + "\n").encode("utf-8")
+                lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _arrow_frame(dataset: Dataset) -> pl.DataFrame:
+    """Build a typed polars frame from row tuples, one Arrow batch per chunk."""
+    name, _, rows = dataset
+    schema = ARROW_SCHEMAS[name]
+    rows = iter(rows)
+    batches = []
+    while True:
+        chunk = list(islice(rows, ARROW_BATCH_ROWS))
+        if not chunk:
+            break
+        batches.append(pl.DataFrame(chunk, schema=schema, orient="row"))
+    frame = pl.concat(batches, rechunk=False) if batches else pl.DataFrame(schema=schema)
+    return frame.with_columns(pl.col("date").str.to_date("%Y-%m-%d"))
+
+
+def _single_arrow_frame(datasets: Iterable[Dataset]) -> pl.DataFrame:
+    # rows must be read before the dataset iterator advances and releases its cursor
+    return _arrow_frame(next(iter(datasets)))
+
+
+def write_parquet(path: str, datasets: Iterable[Dataset]) -> None:
+    """Write the first (only) dataset to a Parquet file."""
+    _single_arrow_frame(datasets).write_parquet(path)
+
+
+def write_arrow_ipc(path: str, datasets: Iterable[Dataset]) -> None:
+    """Write the first (only) dataset to an Arrow IPC (Feather v2) file."""
+    _single_arrow_frame(datasets).write_ipc(path)
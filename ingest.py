@@ -1,6 +1,9 @@
 import datetime as dt
 import time
-from typing import List, Tuple, Optional
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Tuple, Optional, TypeVar
 import io
 import pandas as pd
 import numpy as np
@@ -13,7 +16,8 @@ from pathlib import Path
 import os
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-from app.db import get_connection, init_db, execute_many, execute
+from app.db import get_connection, init_db, execute_many, execute, symbol_ids, bulk_load, bulk_upsert, bump_data_version
+from app.columnar_store import DATA_VERSION_NAME, write_store
 
 # --- Force yfinance to use browser-like headers (helps in containers) ---
 yf.utils.get_yf_headers = lambda: {
@@ -22,6 +26,94 @@ yf.utils.get_yf_headers = lambda: {
 
 WIKI_SP500_URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
 
+# --- HTTP fetching: base URLs can point at a local stub server for offline runs ---
+YAHOO_BASE_URL = os.getenv("YAHOO_BASE_URL", "https://query1.finance.yahoo.com").rstrip("/")
+STOOQ_BASE_URL = os.getenv("STOOQ_BASE_URL", "https://stooq.com").rstrip("/")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "8"))
+INGEST_RATE_PER_SEC = float(os.getenv("INGEST_RATE_PER_SEC", "10"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "3"))
+INGEST_BACKOFF_SECONDS = float(os.getenv("INGEST_BACKOFF_SECONDS", "0.5"))
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class TransientHTTPError(Exception):
+    """A response status worth retrying (rate limited or server error)."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``rate`` calls per second with bursts up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiter = TokenBucket(INGEST_RATE_PER_SEC)
+_thread_local = threading.local()
+
+
+def _session() -> requests.Session:
+    """One pooled HTTP session per worker thread (Session is not thread-safe)."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(HTTP_HEADERS)
+        _thread_local.session = session
+    return session
+
+
+def with_retries(call: Callable[[], T]) -> T:
+    """Run ``call`` through the shared rate limiter, retrying transient failures
+    with exponential backoff and jitter."""
+    delay = INGEST_BACKOFF_SECONDS
+    attempt = 0
+    while True:
+        _rate_limiter.acquire()
+        try:
+            return call()
+        except (requests.ConnectionError, requests.Timeout, TransientHTTPError):
+            if attempt >= INGEST_MAX_RETRIES:
+                raise
+        attempt += 1
+        time.sleep(delay * random.uniform(1.0, 1.5))
+        delay *= 2
+
+
+def http_get(url: str, params: Optional[Dict[str, object]] = None, timeout: float = 10) -> requests.Response:
+    def call() -> requests.Response:
+        resp = _session().get(url, params=params, timeout=timeout)
+        if resp.status_code in RETRY_STATUS_CODES:
+            raise TransientHTTPError(f"HTTP {resp.status_code} from {resp.url}")
+        return resp
+    return with_retries(call)
+
+
+def map_concurrent(func: Callable[[str], T], items: Iterable[str], workers: Optional[int] = None) -> List[T]:
+    """Apply ``func`` to every item on a bounded thread pool, keeping input order."""
+    workers = max(1, workers or INGEST_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as pool:
+        return list(pool.map(func, items))
+
 
 def fetch_sp500_symbols() -> pd.DataFrame:
     # Primary: use yfinance helper to avoid direct scraping
@@ -108,36 +200,32 @@ def fetch_sp500_symbols() -> pd.DataFrame:
     return pd.DataFrame({"symbol": static_symbols, "name": None, "sector": None})
 
 
-def fetch_metadata_and_shares(symbols: List[str]) -> pd.DataFrame:
-    data = []
-    for sym in symbols:
-        try:
-            tk = yf.Ticker(sym)
-            info = tk.get_info()
-            shares = info.get("sharesOutstanding")
-            name = info.get("longName") or info.get("shortName")
-            sector = info.get("sector")
-            row = {"symbol": sym, "shares_outstanding": None, "name": name, "sector": sector}
-            if shares is not None:
-                try:
-                    row["shares_outstanding"] = int(shares)
-                except Exception:
-                    row["shares_outstanding"] = None
-            data.append(row)
-        except Exception:
-            data.append({"symbol": sym, "shares_outstanding": None, "name": None, "sector": None})
-        time.sleep(0.05)
-    return pd.DataFrame(data)
+def _fetch_metadata(sym: str) -> dict:
+    try:
+        info = with_retries(lambda: yf.Ticker(sym).get_info())
+        shares = info.get("sharesOutstanding")
+        name = info.get("longName") or info.get("shortName")
+        sector = info.get("sector")
+        row = {"symbol": sym, "shares_outstanding": None, "name": name, "sector": sector}
+        if shares is not None:
+            try:
+                row["shares_outstanding"] = int(shares)
+            except Exception:
+                row["shares_outstanding"] = None
+        return row
+    except Exception:
+        return {"symbol": sym, "shares_outstanding": None, "name": None, "sector": None}
 
 
-def _chunks(lst: List[str], size: int) -> List[List[str]]:
-    return [lst[i:i+size] for i in range(0, len(lst), size)]
+def fetch_metadata_and_shares(symbols: List[str]) -> pd.DataFrame:
+    return pd.DataFrame(map_concurrent(_fetch_metadata, symbols))
 
 
 def check_yahoo_available() -> bool:
     try:
-        test = yf.download("AAPL", period="5d", interval="1d", progress=False, threads=False)
-        if isinstance(test, pd.DataFrame) and not test.empty:
+        end = dt.date.today()
+        test = _fetch_yahoo_symbol("AAPL", (end - dt.timedelta(days=10)).isoformat(), end.isoformat())
+        if not test.empty:
             return True
     except Exception:
         pass
@@ -146,8 +234,7 @@ def check_yahoo_available() -> bool:
 
 def check_stooq_available() -> bool:
     try:
-        url = "https://stooq.com/q/d/l/?s=aapl&i=d"
-        resp = requests.get(url, timeout=5)
+        resp = http_get(f"{STOOQ_BASE_URL}/q/d/l/", params={"s": "aapl", "i": "d"}, timeout=5)
         if resp.status_code == 200 and "Date" in resp.text:
             return True
     except Exception:
@@ -155,92 +242,161 @@ def check_stooq_available() -> bool:
     return False
 
 
-def fetch_prices_yahoo(symbols: List[str], start: str, end: str) -> pd.DataFrame:
-    records = []
-    for batch in _chunks(symbols, 25):
+def _fetch_yahoo_symbol(sym: str, start: str, end: str) -> pd.DataFrame:
+    """Daily bars for one symbol from Yahoo's chart API (``end`` is exclusive, as in yf.download)."""
+    params = {
+        "period1": int(pd.Timestamp(start, tz="UTC").timestamp()),
+        "period2": int(pd.Timestamp(end, tz="UTC").timestamp()),
+        "interval": "1d",
+        "events": "div,splits",
+    }
+    resp = http_get(f"{YAHOO_BASE_URL}/v8/finance/chart/{sym}", params=params)
+    if resp.status_code != 200:
+        return pd.DataFrame()
+    results = (resp.json().get("chart") or {}).get("result") or []
+    if not results or not results[0].get("timestamp"):
+        return pd.DataFrame()
+    result = results[0]
+    offset = (result.get("meta") or {}).get("gmtoffset") or 0
+    quote = result["indicators"]["quote"][0]
+    adj = (result["indicators"].get("adjclose") or [{}])[0].get("adjclose") or quote.get("close")
+
+    stamps = np.asarray(result["timestamp"], dtype="int64") + offset
+    return pd.DataFrame({
+        "symbol": sym,
+        "date": pd.to_datetime(stamps, unit="s").strftime("%Y-%m-%d"),
+        "close": pd.to_numeric(pd.Series(quote.get("close"), dtype=object), errors="coerce"),
+        "adj_close": pd.to_numeric(pd.Series(adj, dtype=object), errors="coerce"),
+        "volume": pd.Series(quote.get("volume"), dtype="Int64"),
+    })
+
+
+def _fetch_stooq_symbol(sym: str, start: str, end: str) -> pd.DataFrame:
+    resp = http_get(f"{STOOQ_BASE_URL}/q/d/l/", params={"s": sym.lower(), "i": "d"})
+    if resp.status_code != 200:
+        return pd.DataFrame()
+    df = pd.read_csv(io.StringIO(resp.text))
+    if "Date" not in df.columns:
+        return pd.DataFrame()
+    dates = pd.to_datetime(df["Date"])
+    in_range = (dates >= pd.to_datetime(start)) & (dates <= pd.to_datetime(end))
+    df, dates = df[in_range], dates[in_range]
+    close = pd.to_numeric(df["Close"], errors="coerce") if "Close" in df.columns else np.nan
+    volume = df["Volume"] if "Volume" in df.columns else pd.Series(np.nan, index=df.index)
+    return pd.DataFrame({
+        "symbol": sym,
+        "date": dates.dt.strftime("%Y-%m-%d"),
+        "close": close,
+        "adj_close": close,
+        "volume": pd.to_numeric(volume, errors="coerce").round().astype("Int64"),
+    }).reset_index(drop=True)
+
+
+def _fetch_all(source: str, fetch_one: Callable[[str, str, str], pd.DataFrame],
+               symbols: List[str], start: str, end: str) -> pd.DataFrame:
+    """Fetch every symbol concurrently, skipping (and reporting) the ones that fail."""
+    def fetch(sym: str) -> pd.DataFrame:
         try:
-            data = yf.download(batch, start=start, end=end, auto_adjust=False, group_by='ticker', progress=False, threads=False)
+            return fetch_one(sym, start, end)
         except Exception as e:
-            print(f"Yahoo batch download failed for batch starting with '{batch[0]}': {e}. Skipping batch.")
-            data = None
+            print(f"{source} download failed for '{sym}': {e}. Skipping symbol.")
+            return pd.DataFrame()
 
-        if data is None or (isinstance(data, pd.DataFrame) and data.empty):
-            time.sleep(0.1)
-            continue
+    frames = [df for df in map_concurrent(fetch, symbols) if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
 
-        for sym in batch:
-            try:
-                if sym not in data:
-                    if len(batch) == 1 and isinstance(data, pd.DataFrame) and "Close" in data.columns:
-                        df = data.reset_index()
-                    else:
-                        continue
-                else:
-                    df = data[sym].reset_index()
-                df = df.rename(columns={"Date": "date", "Close": "close", "Adj Close": "adj_close", "Volume": "volume"})
-                for _, r in df.iterrows():
-                    records.append({
-                        "symbol": sym,
-                        "date": r["date"].date().isoformat(),
-                        "close": None if pd.isna(r.get("close")) else float(r.get("close")),
-                        "adj_close": None if pd.isna(r.get("adj_close")) else float(r.get("adj_close")),
-                        "volume": None if pd.isna(r.get("volume")) else int(r.get("volume")),
-                    })
-            except Exception:
-                continue
-        time.sleep(0.05)
-    return pd.DataFrame.from_records(records)
+
+def fetch_prices_yahoo(symbols: List[str], start: str, end: str) -> pd.DataFrame:
+    return _fetch_all("Yahoo", _fetch_yahoo_symbol, symbols, start, end)
 
 
 def fetch_prices_stooq(symbols: List[str], start: str, end: str) -> pd.DataFrame:
-    start_dt, end_dt = pd.to_datetime(start), pd.to_datetime(end)
-    records = []
-    for sym in symbols:
-        try:
-            url = f"https://stooq.com/q/d/l/?s={sym.lower()}&i=d"
-            csv = requests.get(url, timeout=10)
-            if csv.status_code != 200:
-                continue
-            df = pd.read_csv(io.StringIO(csv.text))
-            if "Date" not in df.columns:
-                continue
-            df["Date"] = pd.to_datetime(df["Date"])
-            df = df[(df["Date"] >= start_dt) & (df["Date"] <= end_dt)]
-            for _, r in df.iterrows():
-                records.append({
-                    "symbol": sym,
-                    "date": r["Date"].date().isoformat(),
-                    "close": None if pd.isna(r.get("Close")) else float(r.get("Close")),
-                    "adj_close": None if pd.isna(r.get("Close")) else float(r.get("Close")),
-                    "volume": None if pd.isna(r.get("Volume")) else int(r.get("Volume")),
-                })
-        except Exception:
-            continue
-        time.sleep(0.02)
-    return pd.DataFrame.from_records(records)
+    return _fetch_all("Stooq", _fetch_stooq_symbol, symbols, start, end)
 
 
-def generate_synthetic_prices(symbols: List[str], start: str, end: str) -> pd.DataFrame:
+def generate_synthetic_prices(symbols: List[str], start: str, end: str,
+                              last_prices: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    """Random-walk prices on business days; walks continue from ``last_prices`` where given."""
     dates = pd.bdate_range(start=start, end=end)
-    records = []
     rng = np.random.default_rng(42)
-    for sym in symbols:
-        price0 = rng.uniform(20, 300)
-        vols = rng.normal(0.0005, 0.02, size=len(dates))
-        prices = price0 * np.exp(np.cumsum(vols))
-        vols_shares = rng.integers(1_000_000, 10_000_000, size=len(dates))
-        for d, p, v in zip(dates, prices, vols_shares):
-            records.append({
-                "symbol": sym,
-                "date": d.date().isoformat(),
-                "close": float(p),
-                "adj_close": float(p),
-                "volume": int(v),
-            })
-    return pd.DataFrame.from_records(records)
+    n_days, n_symbols = len(dates), len(symbols)
+    # One random walk per column; symbol-major order so each symbol's rows stay together.
+    price0 = rng.uniform(20, 300, size=n_symbols)
+    if last_prices:
+        stored = pd.Series(symbols).map(last_prices).to_numpy(dtype=float)
+        price0 = np.where(np.isnan(stored), price0, stored)
+    prices = price0[:, None] * np.exp(np.cumsum(rng.normal(0.0005, 0.02, size=(n_symbols, n_days)), axis=1))
+    volumes = rng.integers(1_000_000, 10_000_000, size=(n_symbols, n_days))
+    return pd.DataFrame({
+        "symbol": np.repeat(np.asarray(symbols, dtype=object), n_days),
+        "date": np.tile(dates.strftime("%Y-%m-%d").to_numpy(dtype=object), n_symbols),
+        "close": prices.ravel(),
+        "adj_close": prices.ravel(),
+        "volume": volumes.ravel(),
+    })
+
+
+def _column_rows(df: pd.DataFrame, columns: List[str], chunk_rows: int = 100_000) -> Iterable[Tuple]:
+    """Rows of the given columns for executemany, with NaN/NA sent as NULL.
+
+    Converted one slice at a time so only ``chunk_rows`` rows exist as Python objects at once.
+    """
+    for start in range(0, len(df), chunk_rows):
+        part = df.iloc[start:start + chunk_rows]
+        values = [part[c].astype(object).where(part[c].notna(), None).tolist() for c in columns]
+        yield from zip(*values)
+
+
+def _stored_tails(conn) -> pd.DataFrame:
+    """Latest stored date and adjusted close for every symbol that has prices."""
+    return pd.read_sql_query(
+        """
+        SELECT s.symbol, p.date AS last_date, p.adj_close AS last_price
+        FROM stocks s
+        JOIN daily_prices p ON p.symbol_id = s.symbol_id
+        AND p.date = (SELECT MAX(date) FROM daily_prices WHERE symbol_id = s.symbol_id)
+        """,
+        conn,
+    )
 
 
-def main() -> None:
+def _fetch_prices(symbols: List[str], start: str, end: str,
+                  last_prices: Optional[Dict[str, float]] = None,
+                  synthetic: bool = False) -> pd.DataFrame:
+    """Prices from Yahoo, else Stooq; generated ones only if ``synthetic`` and both come back empty."""
+    prices_df = pd.DataFrame()
+    if check_yahoo_available():
+        try:
+            prices_df = fetch_prices_yahoo(symbols, start, end)
+        except Exception:
+            prices_df = pd.DataFrame()
+
+    if prices_df.empty and check_stooq_available():
+        try:
+            prices_df = fetch_prices_stooq(symbols, start, end)
+        except Exception:
+            prices_df = pd.DataFrame()
+
+    if prices_df.empty and synthetic:
+        prices_df = generate_synthetic_prices(symbols, start, end, last_prices)
+    return prices_df
+
+
+def main(full: bool = False, synthetic: bool = False) -> None:
+    """Load prices and market caps for the S&P 500 universe.
+
+    By default only the missing tail is fetched: each symbol starts the day
+    after its latest stored price (new symbols get the full ~6 month window)
+    and only rows after that date are written. ``full=True`` re-downloads and
+    overwrites the whole window. Shares outstanding are stored in ``stocks``
+    the first time a symbol is seen, so market caps stay stable across runs.
+
+    Random-walk prices stand in for the sources only on a full or first run,
+    or with ``synthetic=True``. An empty tail is normal otherwise (weekends,
+    holidays) and means there is nothing new to write.
+    """
     init_db()
     conn = get_connection()
 
@@ -249,51 +405,81 @@ def main() -> None:
         raise RuntimeError("Failed to get symbols.")
 
     end = dt.date.today()
-    start = end - dt.timedelta(days=180)  # ~6 months calendar (≥ 90 weekdays)
+    window_start = end - dt.timedelta(days=180)  # ~6 months calendar (≥ 90 weekdays)
     symbols = meta["symbol"].tolist()
 
-    # Synthetic shares outstanding
+    # Synthetic shares outstanding, kept for symbols that already have a stored value
     meta["shares_outstanding"] = np.random.randint(200_000_000, 10_000_000_000, size=len(meta))
-    execute_many(
-        conn,
-        "INSERT OR REPLACE INTO stocks(symbol, name, sector) VALUES(?, ?, ?)",
-        [(r.symbol, r.name or r.symbol, r.sector or "Tech") for r in meta.itertuples(index=False)]
-    )
-
-    prices_df = pd.DataFrame()
-    if check_yahoo_available():
-        try:
-            prices_df = fetch_prices_yahoo(symbols, start.isoformat(), end.isoformat())
-        except Exception:
-            prices_df = pd.DataFrame()
-
-    if prices_df.empty:
-        prices_df = generate_synthetic_prices(symbols, start.isoformat(), end.isoformat())
-
-    if prices_df.empty:
-        raise RuntimeError("No price data from any source.")
-
     execute_many(
         conn,
         """
-        INSERT OR REPLACE INTO daily_prices(symbol, date, close, adj_close, volume)
-        VALUES(?, ?, ?, ?, ?)""",
-        [(r.symbol, r.date, r.close, r.adj_close, r.volume)
-         for r in prices_df.itertuples(index=False)]
+        INSERT INTO stocks(symbol, name, sector, shares_outstanding) VALUES(?, ?, ?, ?)
+        ON CONFLICT(symbol) DO UPDATE SET
+            name = excluded.name,
+            sector = excluded.sector,
+            shares_outstanding = COALESCE(stocks.shares_outstanding, excluded.shares_outstanding)""",
+        [(r.symbol, r.name or r.symbol, r.sector or "Tech", int(r.shares_outstanding))
+         for r in meta.itertuples(index=False)]
     )
+    ids = symbol_ids(conn)
+    shares = dict(conn.execute("SELECT symbol, shares_outstanding FROM stocks"))
+
+    # Fetch start per symbol: the day after its latest stored price
+    tails = pd.DataFrame(columns=["symbol", "last_date", "last_price"]) if full else _stored_tails(conn)
+    last_dates = {sym: str(d) for sym, d in zip(tails["symbol"], tails["last_date"])}
+    last_prices = dict(zip(tails["symbol"], tails["last_price"]))
+    starts = [
+        dt.date.fromisoformat(last_dates[sym]) + dt.timedelta(days=1) if sym in last_dates else window_start
+        for sym in symbols
+    ]
 
-    prices_df = prices_df.merge(meta[["symbol", "shares_outstanding"]], on="symbol", how="left")
-    prices_df["market_cap"] = prices_df["adj_close"] * prices_df["shares_outstanding"]
-
-    execute_many(
-        conn,
-        "INSERT OR REPLACE INTO daily_market_caps(symbol, date, market_cap) VALUES(?, ?, ?)",
-        [(r.symbol, r.date, r.market_cap) for r in prices_df.itertuples(index=False)]
-    )
+    synthetic = synthetic or tails.empty
+    frames = []
+    # symbols usually share the same latest date, so this is one fetch per distinct start
+    for start, group in pd.Series(symbols).groupby(starts):
+        if start >= end:
+            continue
+        frames.append(_fetch_prices(group.tolist(), start.isoformat(), end.isoformat(), last_prices,
+                                    synthetic))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        if not tails.empty:
+            write_store(conn)  # no-op unless the store is missing, e.g. on first run after upgrading
+            conn.close()
+            print("Ingest complete. Already up to date.")
+            return
+        raise RuntimeError("No price data from any source.")
+    prices_df = pd.concat(frames, ignore_index=True)
+
+    # only write rows after each symbol's stored tail
+    prices_df = prices_df[prices_df["date"] > prices_df["symbol"].map(last_dates).fillna("")].copy()
+    prices_df["symbol_id"] = prices_df["symbol"].map(ids)
+    prices_df["market_cap"] = prices_df["adj_close"] * prices_df["symbol"].map(shares)
+    mcaps_df = prices_df[prices_df["market_cap"].notna()]
+
+    price_cols = ["symbol_id", "date", "close", "adj_close", "volume"]
+    mcap_cols = ["symbol_id", "date", "market_cap"]
+    # bumped first: a load that fails halfway leaves the columnar store marked stale
+    bump_data_version(conn, DATA_VERSION_NAME)
+    with bulk_load(conn):
+        bulk_upsert(conn, "daily_prices", price_cols, _column_rows(prices_df, price_cols),
+                    key=["symbol_id", "date"])
+        bulk_upsert(conn, "daily_market_caps", mcap_cols, _column_rows(mcaps_df, mcap_cols),
+                    key=["symbol_id", "date"])
+    # dates before the first one written are copied from the previous store
+    write_store(conn, since=prices_df["date"].min() if not prices_df.empty else None)
 
     conn.close()
     print(f"Ingest complete. {len(prices_df)} price rows over {prices_df['date'].nunique()} trading days.")
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load market data into the index database.")
+    parser.add_argument("--full", action="store_true",
+                        help="re-download the whole window instead of only the missing days")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="generate prices for missing days when no source returns any")
+    args = parser.parse_args()
+    main(full=args.full, synthetic=args.synthetic)
@@ -0,0 +1,96 @@
+"""Time build_index over 1-20 years of synthetic data to check it scales linearly.
+
+Usage: python scripts/bench_build_index.py [--engine loop|vectorized|parallel] [--symbols 200] [--years 1 2 5 10 20]
+                                           [--columnar-store] [--workers 1 2 4 8]
+
+With --workers, each size is built once per worker count (engine parallel)
+to show how a rebuild scales with cores.
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.config import settings
+from app.columnar_store import write_store
+from app.db import get_connection, init_db, execute_many, symbol_ids
+from app.services.index_service import build_index
+from app.services.vectorized_engine import shutdown_build_pool
+
+
+def make_synthetic_db(path: str, n_symbols: int, years: int) -> Tuple[str, str]:
+    """Create a database with random-walk prices and market caps; return its first and last dates."""
+    end = pd.Timestamp("2025-01-01")
+    dates = pd.bdate_range(end=end, periods=years * 252)
+    date_strs = [d.date().isoformat() for d in dates]
+    symbols = [f"SYN{i:04d}" for i in range(n_symbols)]
+
+    rng = np.random.default_rng(42)
+    prices = rng.uniform(20, 300, n_symbols) * np.exp(
+        np.cumsum(rng.normal(0.0005, 0.02, size=(len(dates), n_symbols)), axis=0)
+    )
+    caps = prices * rng.integers(200_000_000, 10_000_000_000, size=n_symbols)
+
+    conn = get_connection(path)
+    init_db(conn)
+    execute_many(conn, "INSERT INTO stocks(symbol, name, sector) VALUES(?, ?, ?)",
+                 [(s, s, "Tech") for s in symbols])
+    ids = [symbol_ids(conn)[s] for s in symbols]
+    execute_many(conn, "INSERT INTO daily_prices(symbol_id, date, close, adj_close, volume) VALUES(?, ?, ?, ?, ?)",
+                 ((i, d, p, p, 1_000_000)
+                  for d, row in zip(date_strs, prices.tolist()) for i, p in zip(ids, row)))
+    execute_many(conn, "INSERT INTO daily_market_caps(symbol_id, date, market_cap) VALUES(?, ?, ?)",
+                 ((i, d, c)
+                  for d, row in zip(date_strs, caps.tolist()) for i, c in zip(ids, row)))
+    conn.close()
+    return date_strs[0], date_strs[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--engine", default=settings.index_engine)
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--columnar-store", action="store_true",
+                        help="write the columnar store first so the vectorized engine maps it")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        help="time the parallel engine with each of these BUILD_WORKERS values")
+    args = parser.parse_args()
+
+    engine = "parallel" if args.workers else args.engine
+    settings.columnar_store_enabled = args.columnar_store
+    print(f"engine={engine} symbols={args.symbols} columnar_store={args.columnar_store}")
+    print(f"{'years':>5} {'workers':>7} {'days':>6} {'seconds':>9} {'ms/day':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in args.years:
+            path = str(Path(tmp) / f"bench_{years}y.db")
+            start, end = make_synthetic_db(path, args.symbols, years)
+            settings.database_path = path
+            if args.columnar_store:
+                conn = get_connection(path)
+                write_store(conn)
+                conn.close()
+
+            for workers in args.workers or [None]:
+                if workers is not None:
+                    settings.build_workers = workers
+                    build_index(start, end, engine=engine)  # untimed: starts the pool's processes
+
+                t0 = time.perf_counter()
+                result = build_index(start, end, engine=engine)
+                elapsed = time.perf_counter() - t0
+
+                days = result["days_processed"]
+                print(f"{years:>5} {workers or '-':>7} {days:>6} {elapsed:>9.2f} {elapsed / days * 1000:>8.3f}")
+    shutdown_build_pool()
+
+
+if __name__ == "__main__":
+    main()
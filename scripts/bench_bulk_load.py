@@ -0,0 +1,62 @@
+"""Time loading synthetic daily prices with INSERT OR REPLACE versus the bulk-load path.
+
+Usage: python scripts/bench_bulk_load.py [--symbols 2000] [--years 20] [--skip-replace]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.db import bulk_load, bulk_upsert, execute_many, get_connection, init_db, symbol_ids
+from ingest import _column_rows, generate_synthetic_prices
+
+PRICE_COLUMNS = ["symbol_id", "date", "close", "adj_close", "volume"]
+
+
+def load_replace(conn, prices) -> None:
+    execute_many(
+        conn,
+        "INSERT OR REPLACE INTO daily_prices(symbol_id, date, close, adj_close, volume) VALUES(?, ?, ?, ?, ?)",
+        _column_rows(prices, PRICE_COLUMNS),
+    )
+
+
+def load_bulk(conn, prices) -> None:
+    with bulk_load(conn):
+        bulk_upsert(conn, "daily_prices", PRICE_COLUMNS, _column_rows(prices, PRICE_COLUMNS),
+                    key=["symbol_id", "date"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--skip-replace", action="store_true", help="only time the bulk path")
+    args = parser.parse_args()
+
+    symbols = [f"SYN{i:05d}" for i in range(args.symbols)]
+    prices = generate_synthetic_prices(symbols, f"{2025 - args.years}-01-01", "2024-12-31")
+    print(f"{len(prices):,} rows ({args.symbols} symbols x {args.years} years)")
+
+    methods = [("bulk", load_bulk)] if args.skip_replace else [("replace", load_replace), ("bulk", load_bulk)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, load in methods:
+            conn = get_connection(str(Path(tmp) / f"{name}.db"))
+            init_db(conn)
+            execute_many(conn, "INSERT INTO stocks(symbol) VALUES(?)", [(s,) for s in symbols])
+            prices["symbol_id"] = prices["symbol"].map(symbol_ids(conn))
+
+            # first load into an empty table, then the same rows again as updates
+            for phase in ("initial", "reload"):
+                t0 = time.perf_counter()
+                load(conn, prices)
+                elapsed = time.perf_counter() - t0
+                print(f"{name:>8} {phase:>8}: {elapsed:7.2f} s  ({len(prices) / elapsed:,.0f} rows/s)")
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
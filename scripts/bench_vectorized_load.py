@@ -0,0 +1,79 @@
+"""Time the vectorized engine's SQL load: read_sql_query and pivot versus the plain tuple read.
+
+Usage: python scripts/bench_vectorized_load.py [--symbols 500] [--years 10] [--repeat 3]
+                                                [--detect-types none|decltypes]
+
+Both paths load market caps and adjusted closes for the whole range into
+date x symbol matrices; the script checks they agree and prints the best of
+--repeat runs for each.
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.config import settings
+from app.db import get_connection
+from app.services.vectorized_engine import MarketMatrices, _load_from_sql
+from bench_build_index import make_synthetic_db
+
+
+def load_pandas(conn, start: str, end: str) -> MarketMatrices:
+    """The previous load: one read_sql_query per table, pivoted by pandas."""
+    def matrix(sql: str, value: str) -> pd.DataFrame:
+        df = pd.read_sql_query(sql, conn, params=(start, end))
+        df["date"] = df["date"].astype(str)
+        return df.pivot(index="date", columns="symbol_id", values=value).sort_index()
+
+    mcaps = matrix("SELECT date, symbol_id, market_cap FROM daily_market_caps WHERE date BETWEEN ? AND ?",
+                   "market_cap")
+    prices = matrix("SELECT date, symbol_id, adj_close FROM daily_prices WHERE date BETWEEN ? AND ?",
+                    "adj_close").reindex(index=mcaps.index, columns=mcaps.columns)
+    return MarketMatrices(np.asarray(mcaps.index, dtype=str), mcaps.columns.to_numpy(),
+                          mcaps.to_numpy(dtype=float), prices.to_numpy(dtype=float))
+
+
+def best_of(repeat: int, load, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        load(*args)
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--detect-types", default=settings.sqlite_detect_types,
+                        help="SQLITE_DETECT_TYPES for the pool-style connection")
+    args = parser.parse_args()
+
+    settings.sqlite_detect_types = args.detect_types
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        start, end = make_synthetic_db(path, args.symbols, args.years)
+        conn = get_connection(path, read_only=True)
+
+        old, new = load_pandas(conn, start, end), _load_from_sql(conn, start, end)
+        same = all(np.array_equal(a, b, equal_nan=np.asarray(a).dtype.kind == "f") for a, b in zip(old, new))
+        print(f"{old.market_cap.size:,} cells ({args.symbols} symbols x {args.years} years), "
+              f"detect_types={args.detect_types}, identical={same}")
+
+        pandas_s = best_of(args.repeat, load_pandas, conn, start, end)
+        tuples_s = best_of(args.repeat, _load_from_sql, conn, start, end)
+        print(f"{'read_sql_query':>15}: {pandas_s:7.2f} s")
+        print(f"{'tuple read':>15}: {tuples_s:7.2f} s  ({pandas_s / tuples_s:.1f}x)")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Check that every get_composition_changes implementation agrees with the loop.
+
+Usage: python scripts/check_changes_parity.py START_DATE END_DATE
+Runs against the database configured by DATABASE_PATH.
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.index_service import COMPOSITION_CHANGES_METHODS, get_composition_changes
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        raise SystemExit(__doc__)
+    start, end = sys.argv[1], sys.argv[2]
+
+    results = {}
+    for method in COMPOSITION_CHANGES_METHODS:
+        t0 = time.perf_counter()
+        results[method] = get_composition_changes(start, end, method=method)
+        print(f"{method:>5}: {len(results[method])} change days in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    failed = False
+    loop_by_date = {c["date"]: c for c in results["loop"]}
+    for method, changes in results.items():
+        if changes == results["loop"]:
+            continue
+        failed = True
+        by_date = {c["date"]: c for c in changes}
+        for d in sorted(set(loop_by_date) | set(by_date)):
+            if loop_by_date.get(d) != by_date.get(d):
+                print(f"Mismatch on {d}: loop={loop_by_date.get(d)} {method}={by_date.get(d)}")
+                break
+    if failed:
+        raise SystemExit("❌ Implementations differ")
+    print("✅ Implementations match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+import requests
+
+BASE = "http://localhost:8000"
+
+parser = argparse.ArgumentParser(description="Concurrent load against /index-performance")
+parser.add_argument("--base", default=BASE)
+parser.add_argument("--start-date", default="2025-05-12")
+parser.add_argument("--end-date", default="2025-09-12")
+parser.add_argument("--concurrency", type=int, default=64)
+parser.add_argument("--requests", type=int, default=2000)
+parser.add_argument("--clear-cache", action="store_true",
+                    help="start a new cache generation first so the first wave misses")
+args = parser.parse_args()
+
+if args.clear_cache:
+    # Connect to Redis (same host as in docker-compose)
+    r = redis.Redis(host="localhost", port=6379, db=0)
+    generation = r.incr("cache:generation")
+    r.publish("cache:invalidate", generation)
+    print(f"[Cleared cache: now on generation {generation}]")
+
+params = {"start_date": args.start_date, "end_date": args.end_date}
+local = threading.local()
+
+
+def timed_request(_):
+    session = getattr(local, "session", None)
+    if session is None:
+        session = local.session = requests.Session()
+    start = time.perf_counter()
+    resp = session.get(f"{args.base}/index-performance", params=params)
+    elapsed = (time.perf_counter() - start) * 1000  # ms
+    return elapsed, resp.status_code
+
+
+print(f"\n[{args.requests} requests, {args.concurrency} concurrent clients]")
+wall_start = time.perf_counter()
+with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+    results = list(pool.map(timed_request, range(args.requests)))
+wall = time.perf_counter() - wall_start
+
+latencies = sorted(ms for ms, _ in results)
+errors = sum(1 for _, status in results if status != 200)
+p50 = statistics.median(latencies)
+p95 = latencies[int(len(latencies) * 0.95) - 1]
+p99 = latencies[int(len(latencies) * 0.99) - 1]
+
+print(f"Throughput: {len(results) / wall:.1f} req/s over {wall:.2f} s")
+print(f"Latency: p50 {p50:.2f} ms | p95 {p95:.2f} ms | p99 {p99:.2f} ms | max {latencies[-1]:.2f} ms")
+print(f"Errors: {errors}")
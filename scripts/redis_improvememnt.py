@@ -5,12 +5,14 @@ import redis
 BASE = "http://localhost:8000"
 start_date = "2025-05-12"
 end_date = "2025-09-12"
-key = f"perf:{start_date}:{end_date}"
 
-# Connect to Redis (same host as in docker-compose)
+# Connect to Redis (same host as in docker-compose). Cached keys are namespaced
+# by a generation counter, so start a new generation (and tell every worker to
+# drop its local tier) instead of deleting a single key.
 r = redis.Redis(host='localhost', port=6379, db=0)
-print(f"[Clearing Redis key: {key}]")
-r.delete(key)
+generation = r.incr("cache:generation")
+r.publish("cache:invalidate", generation)
+print(f"[Cleared cache: now on generation {generation}]")
 
 params = {"start_date": start_date, "end_date": end_date}
 
@@ -0,0 +1,134 @@
+"""Local stand-in for the Yahoo chart API and Stooq CSV downloads, for offline ingestion runs.
+
+Usage: python scripts/stub_market_data_server.py [--port 8765] [--latency 0.05] [--fail-rate 0.1]
+
+Then point ingest.py at it:
+    YAHOO_BASE_URL=http://127.0.0.1:8765 STOOQ_BASE_URL=http://127.0.0.1:8765 python ingest.py
+
+Prices are a deterministic random walk per symbol over the last ~2 years of
+weekdays. ``--fail-rate`` answers that share of requests with 503 so the
+retry/backoff path gets exercised; the symbol ``MISSING`` always returns 404.
+"""
+import argparse
+import datetime as dt
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+GMT_OFFSET = -14400  # US/Eastern (EDT), as Yahoo reports for NYSE listings
+HISTORY_DAYS = 730
+
+
+def _bars(symbol: str) -> Tuple[List[dt.date], np.ndarray, np.ndarray]:
+    """Weekday dates, closes and volumes for a symbol; the same on every call."""
+    end = dt.date.today()
+    dates = [end - dt.timedelta(days=i) for i in range(HISTORY_DAYS, -1, -1)]
+    dates = [d for d in dates if d.weekday() < 5]
+    rng = np.random.default_rng(zlib.crc32(symbol.upper().encode()))
+    closes = rng.uniform(20, 300) * np.exp(np.cumsum(rng.normal(0.0005, 0.02, size=len(dates))))
+    volumes = rng.integers(1_000_000, 10_000_000, size=len(dates))
+    return dates, np.round(closes, 4), volumes
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    requests_served = 0
+    lock = threading.Lock()
+
+    def do_GET(self) -> None:
+        with self.lock:
+            StubHandler.requests_served += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            self._send(503, "text/plain", b"try again")
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/v8/finance/chart/"):
+            self._yahoo_chart(url.path.rsplit("/", 1)[-1], query)
+        elif url.path == "/q/d/l/":
+            self._stooq_csv(query.get("s", [""])[0])
+        else:
+            self._send(404, "text/plain", b"not found")
+
+    def _yahoo_chart(self, symbol: str, query: dict) -> None:
+        if symbol.upper() == "MISSING":
+            body = {"chart": {"result": None, "error": {"code": "Not Found", "description": "No data found"}}}
+            self._send(404, "application/json", json.dumps(body).encode())
+            return
+        period1 = int(query.get("period1", ["0"])[0])
+        period2 = int(query.get("period2", [str(2 ** 31)])[0])
+        dates, closes, volumes = _bars(symbol)
+        # Yahoo stamps daily bars with the 09:30 US/Eastern open, in UTC seconds.
+        stamps = [
+            int(dt.datetime(d.year, d.month, d.day, 13, 30, tzinfo=dt.timezone.utc).timestamp())
+            for d in dates
+        ]
+        keep = [i for i, ts in enumerate(stamps) if period1 <= ts < period2]
+        result = {
+            "meta": {"symbol": symbol, "gmtoffset": GMT_OFFSET},
+            "timestamp": [stamps[i] for i in keep],
+            "indicators": {
+                "quote": [{
+                    "close": [float(closes[i] * 1.01) for i in keep],
+                    "volume": [int(volumes[i]) for i in keep],
+                }],
+                "adjclose": [{"adjclose": [float(closes[i]) for i in keep]}],
+            },
+        }
+        self._send(200, "application/json", json.dumps({"chart": {"result": [result], "error": None}}).encode())
+
+    def _stooq_csv(self, symbol: str) -> None:
+        if not symbol or symbol.upper() == "MISSING":
+            self._send(200, "text/plain", b"No data")
+            return
+        dates, closes, volumes = _bars(symbol)
+        lines = ["Date,Open,High,Low,Close,Volume"]
+        lines += [f"{d.isoformat()},{c},{c},{c},{c},{v}" for d, c, v in zip(dates, closes, volumes)]
+        self._send(200, "text/csv", ("\n".join(lines) + "\n").encode())
+
+    def _send(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.fail_rate = args.fail_rate
+    ThreadingHTTPServer.request_queue_size = 128  # the default of 5 refuses bursts from many workers
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub market data server on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {StubHandler.requests_served} requests")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("method, url, body", [
+    ("GET", "/index-performance?start_date=2024-01-02&index_id=nope", None),
+    ("GET", "/index-analytics?start_date=2024-01-02&index_id=nope", None),
+    ("GET", "/index-composition?date=2024-01-02&index_id=nope", None),
+    ("GET", "/index-composition-range?start_date=2024-01-02&end_date=2024-01-31&index_id=nope", None),
+    ("GET", "/composition-changes?start_date=2024-01-02&end_date=2024-01-31&index_id=nope", None),
+    ("POST", "/export-data", {"start_date": "2024-01-02", "format": "ndjson", "index_id": "nope"}),
+])
+def test_unknown_index_id_is_rejected_everywhere(method, url, body):
+    response = client.request(method, url, json=body)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown index id: nope"
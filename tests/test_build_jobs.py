@@ -0,0 +1,27 @@
+import time
+
+from app.services import build_jobs as jobs_module
+from app.services.build_jobs import BuildJobQueue
+
+
+def wait_finished(queue: BuildJobQueue, job_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["finished_at"] is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_queue_runs_jobs_again_after_shutdown_and_start(monkeypatch):
+    monkeypatch.setattr(jobs_module, "run_build", lambda request, progress: {"start": request.start_date})
+    queue = BuildJobQueue()
+
+    for start_date in ("2024-01-01", "2024-02-01"):
+        queue.start()
+        job, created = queue.submit(start_date, engine="vectorized")
+        assert created
+        job = wait_finished(queue, job["job_id"])
+        assert job["status"] == "succeeded" and job["result"] == {"start": start_date}
+        queue.shutdown()
@@ -0,0 +1,144 @@
+import json
+import math
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.columnar_store import write_store
+from app.config import settings
+from app.db import execute_many, get_connection, init_db, symbol_ids
+from app.services import vectorized_engine
+from app.services.index_service import build_index
+from app.services.vectorized_engine import shutdown_build_pool
+
+START, END = "2024-01-01", "2024-08-30"
+DEFINITIONS = [
+    {"index_id": "top100"},
+    {"index_id": "top20", "top_n": 20},
+    {"index_id": "cap50", "top_n": 50, "weighting": "cap"},
+    {"index_id": "cap50s", "top_n": 50, "weighting": "cap", "sector_cap": 0.3},
+]
+EQUAL_WEIGHTED = ["top100", "top20"]
+TABLES = {
+    "index_performance": "index_id, date",
+    "index_compositions": "index_id, date, symbol_id",
+    "index_composition_changes": "index_id, date, symbol_id",
+    "index_analytics": "index_id, date",
+}
+
+
+@pytest.fixture(scope="module")
+def market_db(tmp_path_factory):
+    """130 symbols in five sectors with volatile random-walk prices, so memberships churn."""
+    path = str(tmp_path_factory.mktemp("parity") / "market.db")
+    dates = [d.date().isoformat() for d in pd.bdate_range(START, END)]
+    symbols = [f"SYM{i:03d}" for i in range(130)]
+    rng = np.random.default_rng(7)
+    prices = rng.uniform(20, 300, len(symbols)) * np.exp(
+        np.cumsum(rng.normal(0.0, 0.04, size=(len(dates), len(symbols))), axis=0)
+    )
+    shares = rng.integers(100_000_000, 1_000_000_000, size=len(symbols))
+
+    conn = get_connection(path)
+    init_db(conn)
+    execute_many(conn, "INSERT INTO stocks(symbol, name, sector) VALUES(?, ?, ?)",
+                 [(s, s, f"Sector{i % 5}") for i, s in enumerate(symbols)])
+    ids = [symbol_ids(conn)[s] for s in symbols]
+    execute_many(conn, "INSERT INTO daily_prices(symbol_id, date, close, adj_close, volume) VALUES(?, ?, ?, ?, ?)",
+                 [(i, d, p, p, 1_000_000) for d, row in zip(dates, prices.tolist()) for i, p in zip(ids, row)])
+    execute_many(conn, "INSERT INTO daily_market_caps(symbol_id, date, market_cap) VALUES(?, ?, ?)",
+                 [(i, d, p * n) for d, row in zip(dates, prices.tolist())
+                  for i, p, n in zip(ids, row, shares.tolist())])
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def fresh_db(market_db, tmp_path, monkeypatch):
+    """A copy of the market data with no built indexes; returns its path."""
+    path = str(tmp_path / "build.db")
+    shutil.copy(market_db, path)
+    monkeypatch.setattr(settings, "database_path", path)
+    monkeypatch.setattr(settings, "columnar_store_dir", str(tmp_path / "columns"))
+    monkeypatch.setattr(settings, "index_definitions", json.dumps(DEFINITIONS))
+    monkeypatch.setattr(settings, "columnar_store_enabled", False)
+    # several blocks of days even over this short range
+    monkeypatch.setattr(vectorized_engine, "MIN_CHUNK_DAYS", 40)
+    return path
+
+
+def stored(path, index_ids):
+    """Every index table's rows for the given indexes, in key order."""
+    conn = sqlite3.connect(path)
+    try:
+        marks = ", ".join("?" * len(index_ids))
+        return {
+            table: conn.execute(
+                f"SELECT * FROM {table} WHERE index_id IN ({marks}) ORDER BY {key}", index_ids
+            ).fetchall()
+            for table, key in TABLES.items()
+        }
+    finally:
+        conn.close()
+
+
+def assert_same_rows(actual, expected):
+    """Equal rows, with floats allowed to differ in the last bits from a different summation order."""
+    for table, rows in expected.items():
+        assert len(actual[table]) == len(rows), table
+        for got, want in zip(actual[table], rows):
+            assert len(got) == len(want)
+            for a, b in zip(got, want):
+                if isinstance(b, float) and isinstance(a, float):
+                    assert math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-15), (table, got, want)
+                else:
+                    assert a == b, (table, got, want)
+
+
+def build(path, engine, index_ids=None, columnar_store=False):
+    settings.columnar_store_enabled = columnar_store
+    if columnar_store:
+        conn = get_connection(path)
+        write_store(conn)
+        conn.close()
+    result = build_index(START, END, engine=engine, index_ids=index_ids)
+    assert result["status"] == "success"
+    return stored(path, index_ids or [d["index_id"] for d in DEFINITIONS])
+
+
+def test_loop_and_vectorized_engines_agree(fresh_db):
+    vectorized = build(fresh_db, "vectorized", EQUAL_WEIGHTED)
+    assert all(vectorized.values())
+    assert_same_rows(build(fresh_db, "loop", EQUAL_WEIGHTED), vectorized)
+
+
+def test_vectorized_reads_store_and_sql_alike(fresh_db):
+    from_sql = build(fresh_db, "vectorized")
+    assert build(fresh_db, "vectorized", columnar_store=True) == from_sql
+
+
+def test_parallel_engine_matches_vectorized(fresh_db, monkeypatch):
+    vectorized = build(fresh_db, "vectorized")
+    monkeypatch.setattr(settings, "build_workers", 2)
+    try:
+        assert build(fresh_db, "parallel") == vectorized
+    finally:
+        shutdown_build_pool()
+
+
+@pytest.mark.parametrize("engine, index_ids", [("loop", EQUAL_WEIGHTED), ("vectorized", None)])
+def test_incremental_builds_match_a_full_build(fresh_db, engine, index_ids):
+    full = build(fresh_db, engine, index_ids)
+
+    conn = get_connection(fresh_db)
+    for table in TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    conn.close()
+    assert build_index(START, "2024-03-15", engine=engine, index_ids=index_ids)["status"] == "success"
+    assert build_index(None, "2024-06-14", engine=engine, incremental=True, index_ids=index_ids)["status"] == "success"
+    assert build_index(None, None, engine=engine, incremental=True, index_ids=index_ids)["status"] == "success"
+    assert_same_rows(stored(fresh_db, index_ids or [d["index_id"] for d in DEFINITIONS]), full)
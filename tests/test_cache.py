@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app.cache import Cache
+from app.config import settings
+
+
+def make_cache(monkeypatch, async_client=None) -> Cache:
+    monkeypatch.setattr(settings, "redis_enabled", False)
+    cache = Cache()
+    if async_client is not None:
+        cache.enabled, cache.async_client = True, async_client
+    return cache
+
+
+def test_fill_started_before_invalidate_is_not_served_after_it(monkeypatch):
+    cache = make_cache(monkeypatch)
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_fill(keys):
+            started.set()
+            await release.wait()
+            return {key: b'"old"' for key in keys}
+
+        async def fresh_fill(keys):
+            return {key: b'"new"' for key in keys}
+
+        pending = asyncio.ensure_future(cache.aget_or_fill_many_raw(["k"], slow_fill))
+        await started.wait()
+        cache.invalidate()
+        release.set()
+        assert await pending == [b'"old"']
+        return await cache.aget_or_fill_many_raw(["k"], fresh_fill)
+
+    assert asyncio.run(scenario()) == [b'"new"']
+
+
+def test_miss_does_not_join_a_refresh_that_lost_the_lock(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.aioredis.FakeRedis()
+    cache = make_cache(monkeypatch, client)
+    monkeypatch.setattr(settings, "cache_fill_lock_seconds", 0.2)
+    monkeypatch.setattr(settings, "cache_fill_poll_seconds", 0.01)
+
+    async def fill(keys):
+        return {key: b'"filled"' for key in keys}
+
+    async def scenario():
+        # a stale entry, and another worker holding the fill lock for it
+        await cache.aset_many_raw({"k": b'"stale"'}, ttl_seconds=0)
+        await client.set("lock:g0:k", "other-worker")
+        assert await cache.aget_or_fill_many_raw(["k"], fill) == [b'"stale"']
+        # the entry expires while that background refresh is still in flight
+        cache.local.clear()
+        await client.delete("g0:k")
+        return await cache.aget_or_fill_many_raw(["k"], fill)
+
+    assert asyncio.run(scenario()) == [b'"filled"']
+
+
+def test_failed_background_refresh_is_logged(monkeypatch, caplog):
+    cache = make_cache(monkeypatch)
+
+    async def scenario():
+        async def failing_fill(keys):
+            raise RuntimeError("source down")
+
+        task = asyncio.ensure_future(failing_fill(["k"]))
+        cache._background.add(task)
+        task.add_done_callback(cache._background_done)
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    with caplog.at_level("ERROR", logger="app.cache"):
+        asyncio.run(scenario())
+    (record,) = caplog.records
+    assert record.message == "Background cache refresh failed"
+    assert str(record.exc_info[1]) == "source down"
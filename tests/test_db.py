@@ -0,0 +1,14 @@
+from app.db import bulk_load, get_connection
+
+PRAGMAS = ("synchronous", "temp_store", "temp.journal_mode")
+
+
+def test_bulk_load_restores_connection_pragmas(tmp_path):
+    conn = get_connection(str(tmp_path / "bulk.db"))
+    # already on FILE, so restoring temp_store does not recreate the temp schema
+    conn.execute("PRAGMA temp_store=FILE")
+    before = [conn.execute(f"PRAGMA {name}").fetchone()[0] for name in PRAGMAS]
+    with bulk_load(conn):
+        assert conn.execute("PRAGMA temp.journal_mode").fetchone()[0] == "off"
+    assert [conn.execute(f"PRAGMA {name}").fetchone()[0] for name in PRAGMAS] == before
+    conn.close()
@@ -0,0 +1,52 @@
+import datetime as dt
+
+import pandas as pd
+
+import ingest
+from app.config import settings
+from app.db import get_connection
+
+SYMBOLS = ["AAA", "BBB"]
+
+
+def bars(start: dt.date, end: dt.date) -> pd.DataFrame:
+    dates = [d.strftime("%Y-%m-%d") for d in pd.bdate_range(start, end)]
+    return pd.DataFrame({
+        "symbol": [s for s in SYMBOLS for _ in dates],
+        "date": dates * len(SYMBOLS),
+        "close": 100.0,
+        "adj_close": 100.0,
+        "volume": 1_000_000,
+    })
+
+
+def count_rows(table: str) -> int:
+    conn = get_connection()
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_empty_tail_writes_no_rows(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "database_path", str(tmp_path / "ingest.db"))
+    monkeypatch.setattr(settings, "columnar_store_dir", str(tmp_path / "columns"))
+    monkeypatch.setattr(ingest, "fetch_sp500_symbols",
+                        lambda: pd.DataFrame({"symbol": SYMBOLS, "name": SYMBOLS, "sector": "Tech"}))
+    monkeypatch.setattr(ingest, "check_yahoo_available", lambda: True)
+    monkeypatch.setattr(ingest, "check_stooq_available", lambda: True)
+    monkeypatch.setattr(ingest, "fetch_prices_stooq", lambda symbols, start, end: pd.DataFrame())
+
+    # first run: real bars up to a few days ago
+    last = dt.date.today() - dt.timedelta(days=5)
+    monkeypatch.setattr(ingest, "fetch_prices_yahoo",
+                        lambda symbols, start, end: bars(dt.date.fromisoformat(start), last))
+    ingest.main()
+    stored = count_rows("daily_prices")
+    assert stored > 0
+
+    # the tail window has no bars, as over a weekend or a holiday
+    monkeypatch.setattr(ingest, "fetch_prices_yahoo", lambda symbols, start, end: pd.DataFrame())
+    ingest.main()
+    assert count_rows("daily_prices") == stored
+    assert count_rows("daily_market_caps") == stored